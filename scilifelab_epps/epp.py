@@ -21,6 +21,7 @@ from genologics.entities import Artifact, Process
 from genologics.lims import Lims
 from pkg_resources import DistributionNotFound
 from requests import HTTPError
+from requests.adapters import HTTPAdapter, Retry
 
 
 def attach_file(src, resource):
@@ -248,15 +249,17 @@ class ReadResultFiles:
         for outart in outarts:
             file_path = self.get_file_path(outart)
             if file_path:
-                of = open(file_path)
                 file_ext = file_path.split(".")[-1]
+                if file_ext not in ("csv", "txt"):
+                    continue
+                with open(file_path) as of:
+                    lines = of.read().splitlines()
                 if file_ext == "csv":
-                    pf = [row for row in csv.reader(of.read().splitlines())]
+                    pf = [row for row in csv.reader(lines)]
                     parsed_files[outart.name] = pf
                 elif file_ext == "txt":
-                    pf = [row.strip().strip("\\").split("\t") for row in of.readlines()]
+                    pf = [row.strip().strip("\\").split("\t") for row in lines]
                     parsed_files[outart.name] = pf
-                of.close()
         return parsed_files
 
     def format_file(
@@ -450,16 +453,10 @@ def get_well_number(art: Artifact, count_per: str) -> int:
     n_cols = art.container.type.x_dimension["size"]
     n_rows = art.container.type.y_dimension["size"]
 
-    # Get simple dict translating letters to numbers
-    letter2num = {}
-    alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
-    for i, letter in zip(range(1, len(alphabet) + 1), alphabet):
-        letter2num[letter] = i
-
-    # Collect well data from LIMS
+    # Collect well data from LIMS, translating the row letter to a number (A=1, B=2...)
     well_name = art.location[1]
     row_letter, col_num = well_name.split(":")
-    row_num = letter2num[row_letter]
+    row_num = ord(row_letter) - ord("A") + 1
 
     if count_per == "row":
         well_num = (int(row_num) - 1) * n_cols + int(col_num)
@@ -555,6 +552,28 @@ def traceback_to_step(
     return None
 
 
+def pool_lims_connections(
+    lims: Lims,
+    pool_maxsize: int = 32,
+    max_retries: int = 3,
+    backoff_factor: float = 0.2,
+):
+    """Mount a pooled HTTP adapter for https:// on the LIMS request session.
+
+    genologics only mounts its adapter for http://, so requests to an https:// LIMS
+    fall back to the default pool. This only affects traffic through
+    lims.request_session (GETs and file deletes); writes made via Lims.put,
+    put_batch, post and upload_new_file use plain requests calls and are not pooled.
+    Failed connections are retried with an exponential backoff.
+    """
+    adapter = HTTPAdapter(
+        pool_connections=pool_maxsize,
+        pool_maxsize=pool_maxsize,
+        max_retries=Retry(total=max_retries, backoff_factor=backoff_factor),
+    )
+    lims.request_session.mount("https://", adapter)
+
+
 def upload_file(
     file_path: str,
     file_slot: str,
@@ -173,7 +173,7 @@ def format_worklist(df, deck):
         # If transfer volume of current row exceeds max
         if row.transfer_vol > max_vol:
             # Create a row corresponding to the max permitted volume
-            max_vol_transfer = row.copy().to_dict()
+            max_vol_transfer = row.to_dict()
             max_vol_transfer["transfer_vol"] = max_vol
 
             # As long as the transfer volume of the current row exceeds twice the max
@@ -183,7 +183,7 @@ def format_worklist(df, deck):
                 row.transfer_vol -= max_vol
 
             # The remaining volume is higher than the max but lower than twice the max. Split this volume across two transfers.
-            final_split = row.copy().to_dict()
+            final_split = row.to_dict()
             final_split["transfer_vol"] = round(row.transfer_vol / 2)
             # Append both
             for i in range(2):
@@ -1,6 +1,5 @@
 #!/usr/bin/env python
 
-import glob
 import os
 from argparse import ArgumentParser
 
@@ -13,6 +12,25 @@ Author: Chuan Wang, Science for Life Laboratory, Stockholm, Sweden
 """
 
 
+def find_latest_run_file(data_dir, fcid, file_name):
+    """Return the most recently created file_name among the run dirs of data_dir ending with fcid.
+
+    Scans data_dir once and stats each candidate file a single time, instead of
+    globbing and re-stating every match to get its ctime.
+    """
+    ctimes = {}
+    with os.scandir(data_dir) as entries:
+        for entry in entries:
+            if entry.name.startswith(".") or not entry.name.endswith(fcid):
+                continue
+            file_path = os.path.join(entry.path, file_name)
+            try:
+                ctimes[file_path] = os.stat(file_path).st_ctime
+            except OSError:
+                continue
+    return max(ctimes, key=ctimes.__getitem__)
+
+
 def main(lims, args):
     process = Process(lims, id=args.pid)
 
@@ -25,11 +43,8 @@ def main(lims, args):
                 try:
                     lims.upload_new_file(
                         outart,
-                        max(
-                            glob.glob(
-                                f"/srv/ngi-nas-ns/NovaSeqXPlus_data/*{FCID}/RunInfo.xml"
-                            ),
-                            key=os.path.getctime,
+                        find_latest_run_file(
+                            "/srv/ngi-nas-ns/NovaSeqXPlus_data", FCID, "RunInfo.xml"
                         ),
                     )
                 except:
@@ -38,11 +53,10 @@ def main(lims, args):
                 try:
                     lims.upload_new_file(
                         outart,
-                        max(
-                            glob.glob(
-                                f"/srv/ngi-nas-ns/NovaSeqXPlus_data/*{FCID}/RunParameters.xml"
-                            ),
-                            key=os.path.getctime,
+                        find_latest_run_file(
+                            "/srv/ngi-nas-ns/NovaSeqXPlus_data",
+                            FCID,
+                            "RunParameters.xml",
                         ),
                     )
                 except:
@@ -64,11 +78,8 @@ def main(lims, args):
                 try:
                     lims.upload_new_file(
                         outart,
-                        max(
-                            glob.glob(
-                                f"/srv/ngi-nas-ns/NovaSeq_data/*{FCID}/RunInfo.xml"
-                            ),
-                            key=os.path.getctime,
+                        find_latest_run_file(
+                            "/srv/ngi-nas-ns/NovaSeq_data", FCID, "RunInfo.xml"
                         ),
                     )
                 except:
@@ -77,11 +88,8 @@ def main(lims, args):
                 try:
                     lims.upload_new_file(
                         outart,
-                        max(
-                            glob.glob(
-                                f"/srv/ngi-nas-ns/NovaSeq_data/*{FCID}/RunParameters.xml"
-                            ),
-                            key=os.path.getctime,
+                        find_latest_run_file(
+                            "/srv/ngi-nas-ns/NovaSeq_data", FCID, "RunParameters.xml"
                         ),
                     )
                 except:
@@ -58,7 +58,7 @@ def main(lims, args, epp_logger):
                     correct_artifacts = correct_artifacts + 1
                     # Special case for copying values from Aggregate QC step;
                     # Only copy for NGI samples and skip controls
-                    if NGISAMPLE_PAT.findall(artifact.samples[0].name):
+                    if NGISAMPLE_PAT.search(artifact.samples[0].name):
                         if args.aggregate:
                             art_sample_dest = artifact.samples[0].artifact
                         else:
@@ -130,10 +130,18 @@ def get_qbit_csv_data(process):
             "Set 'Minimum required concentration (ng/ul)' to get qc-flags based on this threshold!"
         )
 
-    for target_file in process.result_files():
+    # Map each output to the name of its input once, rather than having every
+    # output look itself up in the input-output maps of its parent process
+    input_names = {}
+    for art_in, art_out in process.input_output_maps:
+        if art_out:
+            input_names.setdefault(art_out["limsid"], art_in["uri"].name)
+
+    result_files = process.result_files()
+    for target_file in result_files:
         conc = None
         new_conc = None
-        file_sample = target_file.input_artifact_list()[0].name
+        file_sample = input_names[target_file.id]
         if file_sample in data:
             try:
                 conc = float(data[file_sample]["concentration"])
@@ -162,12 +170,10 @@ def get_qbit_csv_data(process):
         else:
             missing_samples += 1
     if low_conc:
-        log.append(
-            f"{low_conc}/{len(process.result_files())} samples have low concentration."
-        )
+        log.append(f"{low_conc}/{len(result_files)} samples have low concentration.")
     if missing_samples:
         log.append(
-            f"{missing_samples}/{len(process.result_files())} samples are missing in the Qubit Result File."
+            f"{missing_samples}/{len(result_files)} samples are missing in the Qubit Result File."
         )
     if bad_format:
         log.append(
@@ -77,11 +77,13 @@ def main(lims, args):
                             base_concentration = io2[1]["uri"].udf["Concentration"]
                             base_conc_unit = io2[1]["uri"].udf["Conc. Units"]
             try:
+                # Range is given as e.g. "200 bp to 700 bp", split it once
+                size_range = frag_data[well]["Range"].split("to")
                 io[1]["uri"].udf["Min Size (bp)"] = int(
-                    frag_data[well]["Range"].split("to")[0].split("bp")[0].strip()
+                    size_range[0].split("bp")[0].strip()
                 )
                 io[1]["uri"].udf["Max Size (bp)"] = int(
-                    frag_data[well]["Range"].split("to")[1].split("bp")[0].strip()
+                    size_range[1].split("bp")[0].strip()
                 )
                 if "Ratio (%)" not in io[1]["uri"].udf:
                     io[1]["uri"].udf["Ratio (%)"] = float(frag_data[well]["% Total"])
@@ -22,6 +22,12 @@ DESC = """Script to generate Anglerfish samplesheet for ONT runs.
 
 TIMESTAMP = dt.now().strftime("%y%m%d_%H%M%S")
 
+# Map ONT barcode labels to the fastq paths of their reads, e.g. "./fastq_pass/barcode01/*.fastq.gz"
+BARCODE2FASTQ_PATH = {
+    ont_barcode["label"]: f"./fastq_pass/barcode{ont_barcode['num']:02d}/*.fastq.gz"
+    for ont_barcode in ONT_BARCODES
+}
+
 
 def generate_anglerfish_samplesheet(process):
     """Generate an Anglerfish samplesheet.
@@ -52,9 +58,7 @@ def generate_anglerfish_samplesheet(process):
                 lambda barcode_label: label2dict[barcode_label][i]
             )
 
-        df["fastq_path"] = df["ont_barcode_num"].apply(
-            lambda num: f"./fastq_pass/barcode{str(num).zfill(2)}/*.fastq.gz"
-        )
+        df["fastq_path"] = df["ont_barcode"].map(BARCODE2FASTQ_PATH.__getitem__)
     else:
         df["fastq_path"] = "./fastq_pass/*.fastq.gz"
 
@@ -81,19 +81,19 @@ def idxs_from_label(label: str) -> list[str | tuple[str, str]]:
     idxs: list[str | tuple[str, str]] = []
 
     # Expand 10X single indexes
-    if TENX_SINGLE_PAT.findall(label):
-        match = TENX_SINGLE_PAT.findall(label)[0]
+    if tenx_single_match := TENX_SINGLE_PAT.search(label):
+        match = tenx_single_match.group()
         for tenXidx in Chromium_10X_indexes[match]:
             idxs.append(tenXidx)
     # Case of 10X dual indexes
-    elif TENX_DUAL_PAT.findall(label):
-        match = TENX_DUAL_PAT.findall(label)[0]
+    elif tenx_dual_match := TENX_DUAL_PAT.search(label):
+        match = tenx_dual_match.group()
         i7_idx = Chromium_10X_indexes[match][0]
         i5_idx = Chromium_10X_indexes[match][1]
         idxs.append((i7_idx, revcomp(i5_idx)))
     # Case of SS3 indexes
-    elif SMARTSEQ_PAT.findall(label):
-        match = SMARTSEQ_PAT.findall(label)[0]
+    elif smartseq_match := SMARTSEQ_PAT.search(label):
+        match = smartseq_match.group()
         for i7_idx in SMARTSEQ3_INDEXES[match][0]:
             for i5_idx in SMARTSEQ3_INDEXES[match][1]:
                 idxs.append((i7_idx, revcomp(i5_idx)))
@@ -210,8 +210,8 @@ def get_manifests(process: Process, manifest_root_name: str) -> list[tuple[str,
                     if not user_library or (
                         user_library
                         and (
-                            TENX_DUAL_PAT.findall(lims_label)
-                            or SMARTSEQ_PAT.findall(lims_label)
+                            TENX_DUAL_PAT.search(lims_label)
+                            or SMARTSEQ_PAT.search(lims_label)
                         )
                     ):
                         logging.info(f"Reverse-complementing index2 of {sample.name}.")
@@ -232,7 +232,7 @@ def get_manifests(process: Process, manifest_root_name: str) -> list[tuple[str,
 
                 # Add special case settings
                 row_settings = {}
-                if TENX_SINGLE_PAT.findall(lims_label):
+                if TENX_SINGLE_PAT.search(lims_label):
                     # For 10X 8-mer single indexes (e.g. SI-NA-A1) it is usually required that
                     #  index 1 sequences shall be written as a separate FastQ file (I1).
                     # In this case we need the additional option I1Fastq,TRUE.
@@ -244,8 +244,8 @@ def get_manifests(process: Process, manifest_root_name: str) -> list[tuple[str,
     # Compile sample dataframe
     df_samples = pd.DataFrame(sample_rows)
 
-    # Add PhiX controls
-    df_samples_and_controls = df_samples.copy()
+    # Add PhiX controls, collecting their rows to add them all at once
+    control_rows = []
     for lane, group in df_samples.groupby(["Lane"]):
         if group["phix_loaded"].any():
             phix_set_name = group["phix_set_name"].iloc[0]
@@ -261,10 +261,11 @@ def get_manifests(process: Process, manifest_root_name: str) -> list[tuple[str,
                 row["Project"] = "Control"
                 row["Recipe"] = "0-0"
 
-                df_samples_and_controls = pd.concat(
-                    [df_samples_and_controls, pd.DataFrame([row])], ignore_index=True
-                )
+                control_rows.append(row)
 
+    df_samples_and_controls = pd.concat(
+        [df_samples, pd.DataFrame(control_rows)], ignore_index=True
+    )
     df_samples_and_controls.sort_values(by=["Lane", "SampleName"], inplace=True)
     df_samples_and_controls.reset_index(drop=True, inplace=True)
 
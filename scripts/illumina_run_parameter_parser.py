@@ -191,10 +191,7 @@ def parse_illumina_interop(run_dir):
                 stats.update(
                     {"yield_g": getattr(summary.at(read).at(lane), "yield_g")()}
                 )
-                if lane_nbr not in list(run_stats_summary.keys()):
-                    run_stats_summary.update({lane_nbr: {read: stats}})
-                else:
-                    run_stats_summary[lane_nbr].update({read: stats})
+                run_stats_summary.setdefault(lane_nbr, {})[read] = stats
     return run_stats_summary
 
 
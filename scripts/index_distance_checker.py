@@ -80,9 +80,9 @@ def verify_indexes(data):
 
 def is_special_idx(idx_name):
     if (
-        TENX_DUAL_PAT.findall(idx_name)
-        or TENX_SINGLE_PAT.findall(idx_name)
-        or SMARTSEQ_PAT.findall(idx_name)
+        TENX_DUAL_PAT.search(idx_name)
+        or TENX_SINGLE_PAT.search(idx_name)
+        or SMARTSEQ_PAT.search(idx_name)
         or idx_name == "NoIndex"
     ):
         return True
@@ -137,7 +137,7 @@ def verify_samplename(data):
         subset = [i for i in data if i["pool"] == p]
         subset = sorted(subset, key=lambda d: d["sn"])
         for sample in subset:
-            if not NGISAMPLE_PAT.findall(sample.get("sn", "")):
+            if not NGISAMPLE_PAT.search(sample.get("sn", "")):
                 message.append(
                     "SAMPLE NAME WARNING: Bad sample name format {}".format(
                         sample.get("sn", "")
@@ -2,12 +2,14 @@
 
 import sys
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime as dt
 
 from genologics.config import BASEURI, PASSWORD, USERNAME
 from genologics.entities import Process
 from genologics.lims import Lims
 
+from scilifelab_epps.epp import pool_lims_connections
 from scilifelab_epps.utils import formula, udf_tools
 
 DESC = """ EPP "ONT Update Amounts".
@@ -20,97 +22,105 @@ Alfred Kedhammar, NGI SciLifeLab
 """
 
 
+def put_if_changed(art, udf, val, tolerance=0.005):
+    """Put a numeric UDF, unless the artifact already holds (roughly) the same value."""
+    current = art.udf.get(udf)
+    if current is not None and abs(current - val) < tolerance:
+        return True
+    return udf_tools.put(art, udf, val, on_fail=None)
+
+
 def main(lims, args):
     try:
         currentStep = Process(lims, id=args.pid)
 
-        log = []
         art_tuples = udf_tools.get_art_tuples(currentStep)
 
-        for art_tuple in art_tuples:
-            art_in = art_tuple[0]["uri"]
-            art_out = art_tuple[1]["uri"]
-
-            log.append(f"Input {art_in.name} --> Output {art_out.name}")
-
-            # Get size
-            if udf_tools.is_filled(art_out, "Size (bp)"):
-                size_bp = udf_tools.fetch(art_out, "Size (bp)")
-                log.append(f"'Size (bp)': {size_bp}")
-            else:
-                # Fetch recursively, if appropriate
-                if (
-                    "ONT End-Prep" in currentStep.type.name
-                    or "ONT Barcoding" in currentStep.type.name
-                ):
-                    size_bp, size_bp_history = udf_tools.fetch_last(
-                        currentStep=currentStep,
-                        art_tuple=art_tuple,
-                        target_udfs="Size (bp)",
-                        print_history=True,
-                        on_fail=None,
-                    )
-                    log.append(f"'Size (bp)': {size_bp}\n{size_bp_history}")
-                else:
-                    raise AssertionError(f"Size is not provided for {art_out.name}")
-
-            # Get current metrics
-            vol = udf_tools.fetch(art_out, "Volume (ul)")
-            log.append(f"'Volume (ul)': {vol}")
-            conc_units = udf_tools.fetch(art_out, "Conc. Units")
-            assert conc_units in [
-                "ng/ul",
-                "nM",
-            ], f'Unsupported conc. units "{conc_units}" for art {art_out.name}'
-            log.append(f"'Conc. Units': {conc_units}")
-
-            # Fetch or calculate conc in ng/ul
-            if conc_units == "nM" and size_bp:
-                conc_nM = udf_tools.fetch(art_out, "Concentration")
-                log.append(f"'Concentration': {conc_nM}")
-                conc_ng_ul = formula.nM_to_ng_ul(nM=conc_nM, bp=size_bp)
-                log.append(f"--> Concentration (ng/ul): {conc_ng_ul}")
-            elif conc_units == "ng/ul":
-                conc_ng_ul = udf_tools.fetch(art_out, "Concentration")
-                log.append(f"'Concentration': {conc_ng_ul}")
-            else:
-                raise AssertionError(f"Cannot parse concentration of {art_out.name}")
-
-            # Calculate and put ng amount
-            amount_ng = round(conc_ng_ul * vol, 2)
-            udf_tools.put(art_out, "Amount (ng)", round(amount_ng, 2), on_fail=None)
-            log.append(f"--> 'Amount (ng)': {amount_ng}")
-
-            # Calculate and put fmol amount
-            amount_fmol = round(
-                formula.ng_to_fmol(amount_ng, size_bp),
-                2,
-            )
-            log.append(f"--> 'Amount (fmol)': {amount_fmol}")
-            udf_tools.put(
-                art_out,
-                "Amount (fmol)",
-                round(
-                    formula.ng_to_fmol(amount_ng, size_bp),
-                    2,
-                ),
-                on_fail=None,
-            )
-            log.append("\n")
+        # Size can only be fetched recursively for certain steps
+        step_name = currentStep.type.name
+        fetch_size_recursively = (
+            "ONT End-Prep" in step_name or "ONT Barcoding" in step_name
+        )
 
-        # Write log
+        # Write log as we go
         timestamp = dt.now().strftime("%y%m%d_%H%M%S")
         log_filename = (
             "_".join(["ont_update_amounts_log", currentStep.id, timestamp]) + ".txt"
         )
-        with open(log_filename, "w") as logContext:
-            logContext.write("\n".join(log))
+        with open(log_filename, "w") as log_file:
+            for art_tuple in art_tuples:
+                art_in = art_tuple[0]["uri"]
+                art_out = art_tuple[1]["uri"]
+
+                print(f"Input {art_in.name} --> Output {art_out.name}", file=log_file)
+
+                # Get size
+                size_bp = art_out.udf.get("Size (bp)")
+                if size_bp is not None:
+                    print(f"'Size (bp)': {size_bp}", file=log_file)
+                else:
+                    # Fetch recursively, if appropriate
+                    if fetch_size_recursively:
+                        size_bp, size_bp_history = udf_tools.fetch_last(
+                            currentStep=currentStep,
+                            art_tuple=art_tuple,
+                            target_udfs="Size (bp)",
+                            print_history=True,
+                            on_fail=None,
+                        )
+                        print(
+                            f"'Size (bp)': {size_bp}\n{size_bp_history}", file=log_file
+                        )
+                    else:
+                        raise AssertionError(f"Size is not provided for {art_out.name}")
+
+                # Get current metrics
+                vol = udf_tools.fetch(art_out, "Volume (ul)")
+                print(f"'Volume (ul)': {vol}", file=log_file)
+                conc_units = udf_tools.fetch(art_out, "Conc. Units")
+                assert conc_units in [
+                    "ng/ul",
+                    "nM",
+                ], f'Unsupported conc. units "{conc_units}" for art {art_out.name}'
+                print(f"'Conc. Units': {conc_units}", file=log_file)
+
+                # Fetch or calculate conc in ng/ul
+                if conc_units == "nM" and size_bp:
+                    conc_nM = udf_tools.fetch(art_out, "Concentration")
+                    print(f"'Concentration': {conc_nM}", file=log_file)
+                    conc_ng_ul = formula.nM_to_ng_ul(nM=conc_nM, bp=size_bp)
+                    print(f"--> Concentration (ng/ul): {conc_ng_ul}", file=log_file)
+                elif conc_units == "ng/ul":
+                    conc_ng_ul = udf_tools.fetch(art_out, "Concentration")
+                    print(f"'Concentration': {conc_ng_ul}", file=log_file)
+                else:
+                    raise AssertionError(
+                        f"Cannot parse concentration of {art_out.name}"
+                    )
+
+                # Calculate and put ng amount
+                amount_ng = round(conc_ng_ul * vol, 2)
+                put_if_changed(art_out, "Amount (ng)", amount_ng)
+                print(f"--> 'Amount (ng)': {amount_ng}", file=log_file)
+
+                # Calculate and put fmol amount
+                amount_fmol = round(
+                    formula.ng_to_fmol(amount_ng, size_bp),
+                    2,
+                )
+                print(f"--> 'Amount (fmol)': {amount_fmol}", file=log_file)
+                put_if_changed(art_out, "Amount (fmol)", amount_fmol)
+                print("\n", file=log_file)
 
         # Upload log
         for out in currentStep.all_outputs():
             if out.name == "ONT Update Amounts log":
-                for f in out.files:
-                    lims.request_session.delete(f.uri)
+                with ThreadPoolExecutor(max_workers=8) as executor:
+                    list(
+                        executor.map(
+                            lambda f: lims.request_session.delete(f.uri), out.files
+                        )
+                    )
                 lims.upload_new_file(out, log_filename)
 
     except Exception as e:
@@ -124,5 +134,6 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     lims = Lims(BASEURI, USERNAME, PASSWORD)
+    pool_lims_connections(lims)
     lims.check_version()
     main(lims, args)
@@ -3,18 +3,30 @@ import glob
 import logging
 import os
 from argparse import ArgumentParser, Namespace
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime as dt
 
 import pandas as pd
 from genologics.config import BASEURI, PASSWORD, USERNAME
 from genologics.entities import Artifact, Process
 from genologics.lims import Lims
+from requests.exceptions import HTTPError
 
+from scilifelab_epps.epp import pool_lims_connections
 from scilifelab_epps.utils import udf_tools
 from scilifelab_epps.wrapper import epp_decorator
 
 TIMESTAMP: str = dt.now().strftime("%y%m%d_%H%M%S")
 
+# Anglerfish dataframe columns used to populate sample UDFs, and their types
+ANGLERFISH_COLS: dict[str, str] = {
+    "sample_name": "str",
+    "num_reads": "int64",
+    "mean_read_len": "float64",
+    "std_read_len": "float64",
+    "ont_barcode": "str",
+}
+
 
 def find_run(process: Process) -> str:
     """From the current step, use the ONT run info from previous step to find the run path."""
@@ -43,19 +55,40 @@ def find_run(process: Process) -> str:
     return run_path
 
 
+def scan_ctimes(root: str, prefix: str) -> dict[str, float]:
+    """Recursively collect the paths under root whose names start with prefix,
+    mapped to their ctimes.
+
+    Uses a single os.scandir pass so that each candidate is only stat'ed once.
+    """
+    ctimes = {}
+    dirs = [root]
+    while dirs:
+        with os.scandir(dirs.pop()) as entries:
+            for entry in entries:
+                # Skip hidden files and dirs, like glob does
+                if entry.name.startswith("."):
+                    continue
+                if entry.name.startswith(prefix):
+                    ctimes[entry.path] = entry.stat().st_ctime
+                if entry.is_dir():
+                    dirs.append(entry.path)
+    return ctimes
+
+
 def find_latest_anglerfish_run(run_path: str) -> str:
     anglerfish_query = f"{run_path}/**/anglerfish_run*"
     logging.info(f"Looking for Anglerfish runs with query {anglerfish_query}")
-    anglerfish_glob = glob.glob(anglerfish_query, recursive=True)
+    anglerfish_runs = scan_ctimes(run_path, "anglerfish_run")
 
     assert (
-        len(anglerfish_glob) != 0
+        len(anglerfish_runs) != 0
     ), f"No Anglerfish runs found for query {anglerfish_query}"
 
-    if len(anglerfish_glob) > 1:
-        runs_list = "\n".join(anglerfish_glob)
+    if len(anglerfish_runs) > 1:
+        runs_list = "\n".join(anglerfish_runs)
         logging.warning(f"Multiple Anglerfish runs detected:\n{runs_list}")
-    latest_anglerfish_run_path = max(anglerfish_glob, key=os.path.getctime)
+    latest_anglerfish_run_path = max(anglerfish_runs, key=anglerfish_runs.__getitem__)
     logging.info(f"Using latest Anglerfish run {latest_anglerfish_run_path}")
 
     return latest_anglerfish_run_path
@@ -63,14 +96,14 @@ def find_latest_anglerfish_run(run_path: str) -> str:
 
 def get_anglerfish_text_results(
     lims: Lims,
-    process: Process,
+    outputs: list[Artifact],
     args: Namespace,
     latest_anglerfish_run_path: str,
 ):
     logging.info("Fetching Anglerfish results .txt-file...")
 
     txt_file_slot: Artifact = [
-        outart for outart in process.all_outputs() if outart.name == args.txt_file
+        outart for outart in outputs if outart.name == args.txt_file
     ][0]
 
     file_name = "anglerfish_stats.txt"
@@ -83,14 +116,14 @@ def get_anglerfish_text_results(
 
 def get_anglerfish_dataframe(
     lims: Lims,
-    process: Process,
+    outputs: list[Artifact],
     args: Namespace,
     latest_anglerfish_run_path: str,
 ) -> pd.DataFrame:
     logging.info("Fetching Anglerfish results .csv-file...")
 
     csv_file_slot: Artifact = [
-        outart for outart in process.all_outputs() if outart.name == args.csv_file
+        outart for outart in outputs if outart.name == args.csv_file
     ][0]
 
     file_name = "anglerfish_dataframe.csv"
@@ -100,48 +133,59 @@ def get_anglerfish_dataframe(
     # Upload results to LIMS
     lims.upload_new_file(csv_file_slot, file_path)
 
-    df_raw = pd.read_csv(file_path)
+    # Only parse the columns we need, the rest are kept in the uploaded file.
+    # Declaring the types up front spares the parser from inferring them, and
+    # memory mapping lets the C parser read the file without buffered copies.
+    df_raw = pd.read_csv(
+        file_path,
+        usecols=list(ANGLERFISH_COLS),
+        dtype=ANGLERFISH_COLS,
+        engine="c",
+        memory_map=True,
+    )
 
     return df_raw
 
 
 def parse_data(df_raw: pd.DataFrame):
-    df = df_raw.copy()
+    # The raw df is not used elsewhere, so add columns to it in place
+    df = df_raw
 
-    # Subset df to pre-defined samples
-    df_samples = df[df["sample_name"].notna()].copy()
+    # Only count the reads of pre-defined samples
+    sample_reads = df["num_reads"].where(df["sample_name"].notna())
 
     # Calculate representation metrics across pre-defined samples
-    df_samples["repr_total_pc"] = (
-        df_samples["num_reads"] / df_samples["num_reads"].sum() * 100
-    )
-    df_samples["repr_within_barcode_pc"] = df_samples.apply(
-        # Sample reads divided by sum of all sample reads w. the same barcode
-        lambda row: row["num_reads"]
-        / df_samples[df_samples["ont_barcode"] == row["ont_barcode"]]["num_reads"].sum()
-        * 100
-        if not pd.isna(row["ont_barcode"])
-        else None,
-        axis=1,
-    )
-
-    # Merge new columns back into working df
-    df = df.merge(
-        df_samples[["repr_total_pc", "repr_within_barcode_pc"]],
-        left_index=True,
-        right_index=True,
-        how="left",
-    )
+    df["repr_total_pc"] = sample_reads / sample_reads.sum() * 100
+    # Sample reads divided by sum of all sample reads w. the same barcode,
+    # samples without a barcode are left as NaN
+    barcode_reads = sample_reads.groupby(df["ont_barcode"]).transform("sum")
+    df["repr_within_barcode_pc"] = sample_reads / barcode_reads * 100
 
     # Get barcode number from ID
-    df["ont_barcode_id"] = df["ont_barcode"].apply(
-        lambda x: int(str(x)[-2:]) if pd.notna(x) else None
-    )
+    df["ont_barcode_id"] = pd.to_numeric(df["ont_barcode"].str[-2:])
 
     return df
 
 
-def fill_udfs(process: Process, df: pd.DataFrame):
+def put_sample_udfs(measurement: Artifact, udfs: dict[str, float]) -> bool:
+    """Assign UDFs to a sample one by one, logging the ones that fail.
+
+    Returns whether all UDFs were assigned successfully.
+    """
+    success = True
+    measurement.get(force=True)
+    for udf, value in udfs.items():
+        try:
+            udf_tools.put(measurement, udf, value)
+        except AssertionError:
+            success = False
+            logging.error(
+                f"Could not set UDF '{udf}' to '{value}' for sample '{measurement.name}'"
+            )
+    return success
+
+
+def fill_udfs(process: Process, outputs: list[Artifact], df: pd.DataFrame):
     """Try to assign UDFs to samples in LIMS.
 
     Iterate across all samples and UDFs prior to raising errors.
@@ -151,9 +195,9 @@ def fill_udfs(process: Process, df: pd.DataFrame):
 
     # Get Illumina samples
     measurements = []
-    ops = process.all_outputs()
-    for op in ops:
-        if op.name in list(df.sample_name) and len(op.samples) == 1:
+    sample_names = frozenset(df["sample_name"].to_numpy().tolist())
+    for op in outputs:
+        if op.name in sample_names and len(op.samples) == 1:
             measurements.append(op)
     measurements.sort(key=lambda x: x.name)
 
@@ -172,23 +216,56 @@ def fill_udfs(process: Process, df: pd.DataFrame):
         "ONT Barcode ID": "ont_barcode_id",
     }
 
+    # Read values straight from the column arrays, indexed by sample name,
+    # rather than filtering the df and going through pandas per sample and UDF
+    udf_values = {udf: df[col].to_numpy() for udf, col in udf2col.items()}
+    name_to_row: dict[str, int] = {}
+    for i, sample_name in enumerate(df["sample_name"].to_numpy()):
+        name_to_row.setdefault(sample_name, i)
+
+    # Collect the UDF values of each sample
+    measurement_udfs: list[tuple[Artifact, dict[str, float]]] = []
     for measurement in measurements:
-        sample_name = measurement.name
-        sample_row = df[df["sample_name"] == sample_name]
-
-        # Assign UDFs
-        for udf, col in udf2col.items():
-            if pd.notna(sample_row[col].values[0]):
-                value = float(sample_row[col].values[0])
-
-                try:
-                    udf_tools.put(measurement, udf, value)
-                except AssertionError:
-                    errors = True
-                    logging.error(
-                        f"Could not set UDF '{udf}' to '{value}' for sample '{sample_name}'"
-                    )
-                    continue
+        i = name_to_row[measurement.name]
+
+        udfs = {}
+        for udf, values in udf_values.items():
+            value = values[i]
+            if pd.isna(value):
+                continue
+            try:
+                udfs[udf] = float(value)
+            except (TypeError, ValueError):
+                errors = True
+                logging.error(
+                    f"Could not parse UDF '{udf}' value '{value}' for sample '{measurement.name}'"
+                )
+        measurement_udfs.append((measurement, udfs))
+
+    # Assign UDFs to all samples in a single batch request,
+    # skipping samples for which there is nothing to update
+    updated_measurements = []
+    for measurement, udfs in measurement_udfs:
+        for udf, value in udfs.items():
+            measurement.udf[udf] = value
+        if udfs:
+            updated_measurements.append(measurement)
+    try:
+        if updated_measurements:
+            process.lims.put_batch(updated_measurements)
+    except HTTPError:
+        logging.warning(
+            "Could not batch update sample UDFs, falling back to updating them one by one."
+        )
+        # Assign UDFs one by one to pinpoint the failing ones,
+        # handling the samples concurrently
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            results = executor.map(
+                lambda measurement_udf: put_sample_udfs(*measurement_udf),
+                measurement_udfs,
+            )
+            if not all(list(results)):
+                errors = True
 
     if errors:
         raise AssertionError("Errors when populating sample UDFs.")
@@ -199,17 +276,20 @@ def parse_anglerfish_results(process, lims):
 
     latest_anglerfish_run_path = find_latest_anglerfish_run(run_path)
 
+    # Fetch the step outputs once, they are needed throughout
+    outputs: list[Artifact] = process.all_outputs()
+
     # Upload Anglerfish files and load dataframe
     get_anglerfish_text_results(
         lims,
-        process,
+        outputs,
         args,
         latest_anglerfish_run_path,
     )
 
     df_raw: pd.DataFrame = get_anglerfish_dataframe(
         lims,
-        process,
+        outputs,
         args,
         latest_anglerfish_run_path,
     )
@@ -218,13 +298,14 @@ def parse_anglerfish_results(process, lims):
     df_parsed: pd.DataFrame = parse_data(df_raw)
 
     # Populate sample fields with Anglerfish results
-    fill_udfs(process, df_parsed)
+    fill_udfs(process, outputs, df_parsed)
 
 
 @epp_decorator(script_path=__file__, timestamp=TIMESTAMP)
 def main(args):
     # Set up LIMS
     lims = Lims(BASEURI, USERNAME, PASSWORD)
+    pool_lims_connections(lims)
     process = Process(lims, id=args.pid)
 
     parse_anglerfish_results(process, lims)
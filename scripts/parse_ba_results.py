@@ -3,13 +3,16 @@
 import os
 import re
 import sys
+import tempfile
 import xml.etree.ElementTree as ET
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime as dt
 
 from genologics.config import BASEURI, PASSWORD, USERNAME
 from genologics.entities import Process
 from genologics.lims import Lims
+from requests.exceptions import HTTPError
 
 from scilifelab_epps.epp import get_well_number
 from scilifelab_epps.utils import udf_tools
@@ -20,64 +23,84 @@ It is written to replace the current Illumina-supplied sfdcript consisting of co
 Java which does not as of 2023-08-25 populate the measurement UDFs of interest.
 """
 
+# Define which LIMS UDFs should be populated with which XML metric
+UDF_TO_XML = (
+    # (LIMS UDF, XML name, type)
+    ("Min Size (bp)", "StartBasePair", int),
+    ("Max Size (bp)", "EndBasePair", int),
+    ("Concentration", "RegionConcentration", float),
+    ("Size (bp)", "AverageSize", int),
+    ("Ratio (%)", "PercentTotal", float),
+)
+
+# How to convert XML metrics to each type, integers are given as rounded decimals
+XML_CONVERTERS = {
+    int: lambda text: int(round(float(text), 0)),
+    float: float,
+}
+
 
 def main(lims, args):
     currentStep = Process(lims, id=args.pid)
+    # Fetch all output artifacts in a single batch request, rather than lazily one by one
+    outputs = currentStep.all_outputs(resolve=True)
     log = []
     count_per = "row"  # BioAnalyzer XML numbers wells row-wise
     ngi_sample_id_pattern = r"(p|P)\d+_\d+"
 
-    # Set up an XML tree from the BioAnalyser output file
-    xml_tree = ET.fromstring(get_ba_output_file(currentStep, log))
-    xml_samples = xml_tree.find(".//Samples")
+    # Stream the samples from the BioAnalyser output file
+    content = get_ba_output_file(outputs, log)
+    assert content is not None, "No BioAnalyzer .xml file found"
+    xml_samples = parse_xml_samples(
+        content,
+        [xml_query for _, xml_query, _ in UDF_TO_XML],
+    )
     log.append(f"{len(xml_samples)} samples found in .xml file.")
 
-    # Grab the output measurements, i.e. output artifacts with a defined location
-    lims_arts = [art for art in currentStep.all_outputs() if art.location[1]]
-    log.append(f"{len(lims_arts)} LIMS measurements to be processed.")
+    # Index the samples by well number, keeping duplicates to be able to report them
+    well_to_xml_samples = {}
+    for xml_sample in xml_samples:
+        well_to_xml_samples.setdefault(xml_sample["well_number"], []).append(xml_sample)
 
-    # Define which LIMS UDFs should be populated with which XML metric
-    udf_to_xml = {
-        # {LIMS UDF: (XML name, type)}
-        "Min Size (bp)": ("StartBasePair", int),
-        "Max Size (bp)": ("EndBasePair", int),
-        "Concentration": ("RegionConcentration", float),
-        "Size (bp)": ("AverageSize", int),
-        "Ratio (%)": ("PercentTotal", float),
-    }
+    # Grab the output measurements, i.e. output artifacts with a defined location,
+    # along with their well numbers (None if they can not be determined)
+    lims_arts = []
+    for art in outputs:
+        if art.location[1]:
+            try:
+                well_num = get_well_number(art, count_per)
+            except Exception:
+                well_num = None
+            lims_arts.append((art, well_num))
+    log.append(f"{len(lims_arts)} LIMS measurements to be processed.")
 
     log.append(
         "\nFor each sample, populate the following UDFs with the following .xml nests"
     )
-    for i, j in udf_to_xml.items():
-        log.append(f"{i} --> {j}")
+    for udf_name, xml_query, return_type in UDF_TO_XML:
+        log.append(f"{udf_name} --> {(xml_query, return_type)}")
 
     # Iterate over output measurements and gather the results
-    for lims_art in lims_arts:
+    lims_art_udfs = []
+    for lims_art, lims_well_num in lims_arts:
         log.append(f"\nProcessing measurement '{lims_art.name}'...")
 
-        # Find the corresponding well number
-        try:
-            lims_well_num = get_well_number(lims_art, count_per)
-            log.append(
-                f"Well '{lims_art.location[1]}' corresponds to {count_per}-wise well number {lims_well_num}"
-            )
-        except:
+        # Report the corresponding well number
+        if lims_well_num is None:
             log.append(
                 f"ERROR: Could not determine the well number of {lims_art.name}, skipping."
             )
             continue
+        log.append(
+            f"Well '{lims_art.location[1]}' corresponds to {count_per}-wise well number {lims_well_num}"
+        )
 
         # Isolate the XML sample nest w. the same well as the measurement
-        xml_matching_samples = [
-            sample_node
-            for sample_node in xml_samples
-            if int(sample_node.find("WellNumber").text.strip()) == lims_well_num
-        ]
+        xml_matching_samples = well_to_xml_samples.get(lims_well_num, [])
 
         if len(xml_matching_samples) == 1:
             xml_sample = xml_matching_samples[0]
-            xml_sample_name = xml_sample.find(".//Name").text.strip()
+            xml_sample_name = xml_sample["name"]
             log.append(
                 f"Found .xml sample '{xml_sample_name}' matching {count_per}-wise well number {lims_well_num}."
             )
@@ -108,85 +131,188 @@ def main(lims, args):
             raise AssertionError
 
         # Get the xml smear metrics
-        try:
-            xml_results = xml_sample.find(".//RegionsMolecularResults")
-            assert xml_results
-            log.append("Fetched sample results section from .xml.")
-        except:
+        xml_results = xml_sample["results"]
+        if xml_results is None:
             log.append("ERROR: No smear region was found, skipping.")
             continue
+        log.append("Fetched sample results section from .xml.")
 
         # Grab the target results from the xml smear metrics
-        for udf_name in udf_to_xml:
-            xml_query, return_type = udf_to_xml[udf_name]
-
-            result = xml_results.find(f".//{xml_query}").text.strip()
-            if return_type is int:
-                result = int(round(float(result), 0))
-            elif return_type is float:
-                result = float(result)
+        art_udfs = {}
+        for udf_name, xml_query, return_type in UDF_TO_XML:
+            result = XML_CONVERTERS[return_type](xml_results[xml_query].strip())
 
-            try:
-                # For concentrations (given in pg/ul), convert to ng/ul
-                if udf_name == "Concentration":
-                    result = result / 1000
-                    udf_tools.put(lims_art, "Conc. Units", "ng/ul")
-
-                udf_tools.put(lims_art, udf_name, result)
+            # For concentrations (given in pg/ul), convert to ng/ul
+            if udf_name == "Concentration":
+                result = result / 1000
+                art_udfs["Conc. Units"] = "ng/ul"
 
-                log.append(f"{udf_name} --> {result}")
+            art_udfs[udf_name] = result
 
-            except AssertionError:
-                log.append(
-                    f"ERROR: Could not assign UDF {udf_name} of measurement {lims_art.name}, skipping."
-                )
-                continue
+            log.append(f"{udf_name} --> {result}")
 
+        lims_art_udfs.append((lims_art, art_udfs))
         log.append("Successfully pulled metrics.")
 
+    # Assign the UDFs of all measurements in a single batch request
+    if lims_art_udfs:
+        for lims_art, art_udfs in lims_art_udfs:
+            for udf_name, result in art_udfs.items():
+                lims_art.udf[udf_name] = result
+        try:
+            lims.put_batch([lims_art for lims_art, _ in lims_art_udfs])
+            log.append(f"\nAssigned UDFs of {len(lims_art_udfs)} measurements.")
+        except HTTPError:
+            log.append("\nCould not batch assign UDFs, assigning them one by one.")
+            for lims_art, art_udfs in lims_art_udfs:
+                lims_art.get(force=True)
+                for udf_name, result in art_udfs.items():
+                    try:
+                        udf_tools.put(lims_art, udf_name, result)
+                    except AssertionError:
+                        log.append(
+                            f"ERROR: Could not assign UDF {udf_name} of measurement {lims_art.name}, skipping."
+                        )
+
     # Write log
     timestamp = dt.now().strftime("%y%m%d_%H%M%S")
     log_filename = (
         "_".join(["parse_bioanalyzer_xml_log", currentStep.id, timestamp]) + ".txt"
     )
-    with open(log_filename, "w") as logContext:
-        logContext.write("\n".join(log))
-
-    # Upload log
-    for out in currentStep.all_outputs():
-        if out.name == "Bioanalyzer XML Parsing Log File":
-            for f in out.files:
-                lims.request_session.delete(f.uri)
-            lims.upload_new_file(out, log_filename)
-
-            # Clean up
-            os.remove(log_filename)
-
-            if any("ERROR" in entry for entry in log):
-                sys.stderr.write("Some samples were skipped, please check the Log file")
-                sys.exit(2)
-
-            if any("WARNING" in entry for entry in log):
-                sys.stderr.write(
-                    "Some samples generated warnings, please check the Log file"
-                )
-                sys.exit(2)
+    # Write the log in a temporary directory, which is removed once it is uploaded
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        log_path = os.path.join(tmp_dir, log_filename)
+        with open(log_path, "w") as logContext:
+            logContext.writelines(f"{entry}\n" for entry in log)
+
+        # Upload log
+        for out in outputs:
+            if out.name == "Bioanalyzer XML Parsing Log File":
+                # Delete the old logs concurrently, then upload the new one
+                with ThreadPoolExecutor(max_workers=8) as executor:
+                    list(
+                        executor.map(
+                            lambda f: lims.request_session.delete(f.uri), out.files
+                        )
+                    )
+                lims.upload_new_file(out, log_path)
 
+                if any("ERROR" in entry for entry in log):
+                    sys.stderr.write(
+                        "Some samples were skipped, please check the Log file"
+                    )
+                    sys.exit(2)
 
-def get_ba_output_file(currentStep, log):
+                if any("WARNING" in entry for entry in log):
+                    sys.stderr.write(
+                        "Some samples generated warnings, please check the Log file"
+                    )
+                    sys.exit(2)
+
+
+class BioAnalyzerSampleTarget:
+    """XML parser target collecting the sample nests of a BioAnalyzer XML report.
+
+    Only the well number, name and queried smear metrics of each sample in the first
+    <Samples> nest are kept. No elements are built along the way.
+    """
+
+    def __init__(self, xml_queries):
+        self.xml_queries = xml_queries
+        self.xml_samples = []
+        self.text = []
+        self.depth = 0
+        self.samples_depth = None
+        self.samples_done = False
+        self.xml_sample = None
+        self.results_depth = None
+        self.results_seen = False
+
+    def start(self, tag, attrib):
+        self.depth += 1
+        self.text = []
+
+        if self.samples_done:
+            return
+        if self.samples_depth is None:
+            # Only use the first <Samples> nest of the report
+            if tag == "Samples":
+                self.samples_depth = self.depth
+        elif self.depth == self.samples_depth + 1:
+            self.xml_sample = {"well_number": None, "name": None, "results": None}
+        elif self.xml_sample is not None:
+            if self.results_depth is not None:
+                # Smear metrics are only kept if there are any
+                if self.xml_sample["results"] is None:
+                    self.xml_sample["results"] = dict.fromkeys(self.xml_queries)
+            elif tag == "RegionsMolecularResults" and not self.results_seen:
+                # Only use the first smear metrics nest of the sample
+                self.results_depth = self.depth
+                self.results_seen = True
+
+    def data(self, data):
+        self.text.append(data)
+
+    def end(self, tag):
+        text = "".join(self.text)
+        self.text = []
+
+        if self.xml_sample is not None:
+            if self.depth == self.samples_depth + 1:
+                self.xml_sample["well_number"] = int(
+                    self.xml_sample["well_number"].strip()
+                )
+                self.xml_samples.append(self.xml_sample)
+                self.xml_sample = None
+                self.results_seen = False
+            elif self.depth == self.results_depth:
+                self.results_depth = None
+            elif tag == "WellNumber" and self.depth == self.samples_depth + 2:
+                self.xml_sample["well_number"] = text
+            elif tag == "Name" and self.xml_sample["name"] is None:
+                self.xml_sample["name"] = text.strip()
+            elif (
+                self.results_depth is not None
+                and tag in self.xml_queries
+                and self.xml_sample["results"][tag] is None
+            ):
+                self.xml_sample["results"][tag] = text
+        elif self.depth == self.samples_depth:
+            self.samples_done = True
+
+        self.depth -= 1
+
+    def close(self):
+        return self.xml_samples
+
+
+def parse_xml_samples(content, xml_queries):
+    """Parse the sample nests of a BioAnalyzer XML report.
+
+    The content is parsed as returned by LIMS. Text is parsed as is, while bytes
+    and streamed responses are left for the XML parser to decode.
+    """
+    parser = ET.XMLParser(target=BioAnalyzerSampleTarget(xml_queries))
+    if isinstance(content, (str, bytes)):
+        parser.feed(content)
+    else:
+        for chunk in iter(lambda: content.read(2**16), b""):
+            parser.feed(chunk)
+    return parser.close()
+
+
+def get_ba_output_file(outputs, log):
     content = None
-    for outart in currentStep.all_outputs():
+    for outart in outputs:
         # Try fetching the BA result file from the uploaded file in LIMS
         if (
             outart.type == "ResultFile"
             and outart.name == "Bioanalyzer XML Result File (required)"
         ):
-            try:
+            if outart.files:
                 fid = outart.files[0].id
                 content = lims.get_file_contents(id=fid)
-                if isinstance(content, bytes):
-                    content = content.decode("utf-8")
-            except:
+            else:
                 log.append("No BioAnalyzer .xml file found")
             break
     return content
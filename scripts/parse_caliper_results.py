@@ -7,26 +7,37 @@ Author: Chuan Wang, Science for Life Laboratory, Stockholm, Sweden
 """
 
 import csv
+import io
 import re
 import sys
 from argparse import ArgumentParser
+from itertools import chain
 
 from genologics.config import BASEURI, PASSWORD, USERNAME
 from genologics.entities import Process
 from genologics.lims import Lims
+from requests.exceptions import HTTPError
 
 from scilifelab_epps.epp import EppLogger, set_field
 
-NGISAMPLE_PAT = re.compile("P[0-9]+_[0-9]+")
-CALIPER_PAT = re.compile(r"CaliperGX \([D|R]NA\) (.*)")
+CALIPER_PAT = re.compile(r"CaliperGX \([DR]NA\) (.*)")
 SAMPLENAME_PAT = re.compile("[A-H][1-9][0-2]?_(.*)_[0-9]+-[0-9]+_([0-9]+-[0-9]+)*")
-DV200_PAT = re.compile("Region[[0-9]+-[0-9]+] % of Total Area")
+DV200_PAT = re.compile(r"Region\[[0-9]+-[0-9]+\] % of Total Area")
+# Translation table stripping square brackets from values, e.g. "[12.5]" --> "12.5"
+BRACKETS_TRANS = str.maketrans("", "", "[]")
+# Well label to LIMS well position lookup, e.g. "A01" and "A1" --> "A:1"
+WELL_FMT = {
+    f"{row}{col:{width}}": f"{row}:{col}"
+    for row in "ABCDEFGHIJKLMNOP"
+    for col in range(1, 25)
+    for width in ("02d", "d")
+}
 
 
 # Get file
-def get_caliper_output_file(process, log):
+def get_caliper_output_file(outputs, log):
     content = None
-    for outart in process.all_outputs():
+    for outart in outputs:
         # Try fetching the Caliper result file from the uploaded file in LIMS
         if (
             outart.type == "ResultFile"
@@ -35,8 +46,11 @@ def get_caliper_output_file(process, log):
             try:
                 fid = outart.files[0].id
                 content = lims.get_file_contents(id=fid)
-                if isinstance(content, bytes):
-                    content = content.decode("utf-8")
+                # Read binary responses as a text stream rather than decoding upfront
+                if isinstance(content, str):
+                    content = io.StringIO(content, newline="")
+                else:
+                    content = io.TextIOWrapper(content, encoding="utf-8", newline="")
             except:
                 log.append("No Caliper WellTable file found")
             break
@@ -44,35 +58,44 @@ def get_caliper_output_file(process, log):
 
 
 # Parse file content
-def get_data(content, log):
+def get_data(content, log, delimiter=None):
     data = dict()
-    headers = dict()
-    dialect = csv.Sniffer().sniff(content)
-    pf = csv.reader(content.splitlines(), dialect=dialect)
-    for row in pf:
-        try:
-            # Header line
-            if "Sample Name" in row:
-                for item in row:
-                    headers[item] = row.index(item)
-            else:
-                sample_data = dict()
-                for k, v in headers.items():
-                    sample_data[k] = row[v]
-                data.update({row[headers["Sample Name"]]: sample_data})
-        except:
+    # Read the first few KB, up to a line break, and chain them back to the stream
+    head = content.read(4096) + content.readline()
+    lines = chain(io.StringIO(head, newline=""), content)
+    # Use the given delimiter, or sniff the dialect from the first few KB
+    if delimiter:
+        fmtparams = {"delimiter": delimiter}
+    else:
+        fmtparams = {"dialect": csv.Sniffer().sniff(head, delimiters=",\t;")}
+    # Skip ahead to the header line
+    for row in csv.reader(lines, **fmtparams):
+        if "Sample Name" in row:
+            headers = row
+            break
+        log.append("Caliper WellTable file in bad format")
+    else:
+        return data
+    # The remaining lines are read as dicts keyed by the header
+    for sample_data in csv.DictReader(lines, fieldnames=headers, **fmtparams):
+        # Ignore any extra trailing fields, collected under the None key
+        sample_data.pop(None, None)
+        if None in sample_data.values():
             log.append("Caliper WellTable file in bad format")
+            continue
+        data[sample_data["Sample Name"]] = sample_data
     # Process data to include sample ID and well
     for k, v in data.items():
-        try:
-            data[k]["Sample"] = SAMPLENAME_PAT.findall(k)[0][0]
-            data[k]["Well"] = v["Well Label"][:1] + ":" + str(int(v["Well Label"][1:]))
-        except IndexError:
-            pass
+        if sample_match := SAMPLENAME_PAT.search(k):
+            v["Sample"] = sample_match.group(1)
+            well_label = v["Well Label"]
+            v["Well"] = WELL_FMT.get(well_label) or (
+                well_label[:1] + ":" + str(int(well_label[1:]))
+            )
     return data
 
 
-def parse_caliper_results(process):
+def parse_caliper_results(process, delimiter=None):
     # Sample UDF and data map
     map = []
     map_RNA = [
@@ -93,60 +116,72 @@ def parse_caliper_results(process):
 
     # strings returned to the EPP user
     log = []
+    # Fetch all output artifacts once, in a single batch request
+    outputs = process.all_outputs(resolve=True)
     # Get file contents by parsing lims artifacts
-    content = get_caliper_output_file(process, log)
+    content = get_caliper_output_file(outputs, log)
     # parse the Caliper output
-    data = get_data(content, log)
-
-    # Fill values in LIMS
-    for out in process.all_outputs():
-        if CALIPER_PAT.findall(out.name):
-            found_flag = False
-            for k, v in data.items():
-                if (
-                    "Sample" in v.keys()
-                    and v["Sample"] == CALIPER_PAT.findall(out.name)[0]
-                    and v["Well"] == out.location[1]
-                ):
-                    found_flag = True
-                    for item in map:
-                        target_column = ""
-                        if item[0] == "DV200":
-                            for field in v.keys():
-                                if DV200_PAT.findall(field):
-                                    target_column = DV200_PAT.findall(field)[0]
-                        else:
-                            if item[1] in v.keys():
-                                target_column = item[1]
-                        if (
-                            target_column != ""
-                            and v[target_column] != "NA"
-                            and v[target_column] != ""
-                        ):
-                            out.udf[item[0]] = float(
-                                re.sub(r"\[|\]", "", v[target_column])
-                            )
-                        else:
-                            log.append(
-                                "Sample {} in well {} missing {}.".format(
-                                    v["Sample"], v["Well"], item[0]
-                                )
-                            )
-                        out.udf["Conc. Units"] = "ng/ul"
-            if found_flag:
-                out.put()
-                set_field(out)
+    data = get_data(content, log, delimiter)
+
+    # Index the data by sample and well
+    sample_well_data = {
+        (v["Sample"], v.get("Well")): v for v in data.values() if "Sample" in v
+    }
+
+    # The DV200 column is named after its region, look it up once from the header
+    dv200_column = ""
+    for field in next(iter(data.values()), {}):
+        if dv200_match := DV200_PAT.search(field):
+            dv200_column = dv200_match.group()
+
+    # Fill values in LIMS, collecting the updated artifacts to put them all at once
+    updated_outs = []
+    for out in outputs:
+        caliper_match = CALIPER_PAT.match(out.name)
+        if not caliper_match:
+            continue
+        sample_tag = caliper_match.group(1)
+        v = sample_well_data.get((sample_tag, out.location[1]))
+        if v is None:
+            log.append(
+                f"No record of sample {sample_tag} in well {out.location[1]} in the Caliper WellTable file."
+            )
+            continue
+        for item in map:
+            target_column = ""
+            if item[0] == "DV200":
+                target_column = dv200_column
+            else:
+                if item[1] in v.keys():
+                    target_column = item[1]
+            if (
+                target_column != ""
+                and v[target_column] != "NA"
+                and v[target_column] != ""
+            ):
+                out.udf[item[0]] = float(v[target_column].translate(BRACKETS_TRANS))
             else:
                 log.append(
-                    f"No record of sample {NGISAMPLE_PAT.findall(out.name)[0]} in well {out.location[1]} in the Caliper WellTable file."
+                    "Sample {} in well {} missing {}.".format(
+                        v["Sample"], v["Well"], item[0]
+                    )
                 )
+            out.udf["Conc. Units"] = "ng/ul"
+        updated_outs.append(out)
+
+    if updated_outs:
+        try:
+            process.lims.put_batch(updated_outs)
+        except HTTPError:
+            for out in updated_outs:
+                set_field(out)
 
     print("".join(log), file=sys.stderr)
 
 
-def main(lims, pid, epp_logger):
+def main(lims, pid, delimiter, epp_logger):
     process = Process(lims, id=pid)
-    parse_caliper_results(process)
+    parse_caliper_results(process, delimiter)
 
 
 if __name__ == "__main__":
@@ -161,6 +196,14 @@ if __name__ == "__main__":
             "File name for standard log file, " "for runtime information and problems."
         ),
     )
+    parser.add_argument(
+        "--delimiter",
+        dest="delimiter",
+        help=(
+            "Delimiter of the Caliper WellTable file. If not given, "
+            "the CSV dialect is sniffed from the start of the file."
+        ),
+    )
 
     args = parser.parse_args()
 
@@ -168,4 +211,4 @@ if __name__ == "__main__":
     lims.check_version()
 
     with EppLogger(log_file=args.log, lims=lims, prepend=True) as epp_logger:
-        main(lims, args.pid, epp_logger)
+        main(lims, args.pid, args.delimiter, epp_logger)
@@ -8,82 +8,107 @@ Author: Chuan Wang, Science for Life Laboratory, Stockholm, Sweden
 """
 
 import csv
+import io
 import sys
 from argparse import ArgumentParser
+from itertools import chain, takewhile
 
 from genologics.config import BASEURI, PASSWORD, USERNAME
 from genologics.entities import Process
 from genologics.lims import Lims
+from requests.exceptions import HTTPError
 
 from scilifelab_epps.epp import EppLogger, set_field
 
 VOL_WARNING_THRESHOLD = 5
 
+# Well label to LIMS well position lookup, e.g. "A01" and "A1" --> "A:1"
+WELL_FMT = {
+    f"{row}{col:{width}}": f"{row}:{col}"
+    for row in "ABCDEFGHIJKLMNOP"
+    for col in range(1, 25)
+    for width in ("02d", "d")
+}
 
-def get_vc100_file(process, log):
+
+def get_vc100_file(outputs, log):
     output = None
-    for outart in process.all_outputs():
+    for outart in outputs:
         # get the right output artifact
         if outart.type == "ResultFile" and outart.name == "VC100 CSV File":
             try:
                 fid = outart.files[0].id
                 content = lims.get_file_contents(id=fid)
-                if isinstance(content.data, bytes):
-                    output = content.data.decode("utf-8")
+                # Read binary responses as a text stream rather than decoding upfront
+                if isinstance(content, str):
+                    output = io.StringIO(content, newline="")
+                else:
+                    output = io.TextIOWrapper(content, encoding="utf-8", newline="")
             except:
                 log.append("Cannot parse VC100 output file")
             break
     return output, log
 
 
-def get_data(content):
+def get_data(content, delimiter=None):
     data = dict()
-    headers = dict()
-    dialect = csv.Sniffer().sniff(content)
-    pf = csv.reader(content.splitlines(), dialect=dialect)
+    # Read the first few KB, up to a line break, and chain them back to the stream
+    head = content.read(4096) + content.readline()
+    lines = chain(io.StringIO(head, newline=""), content)
+    # Use the given delimiter, or sniff the dialect from the first few KB
+    if delimiter:
+        fmtparams = {"delimiter": delimiter}
+    else:
+        fmtparams = {"dialect": csv.Sniffer().sniff(head, delimiters=",\t;")}
+    pf = csv.reader(lines, **fmtparams)
+    # Skip ahead to the header row
     for line in pf:
-        # this is the header row
         if "TUBE" in line:
-            for item in line:
-                headers[item] = line.index(item)
-        else:
-            well = line[headers["TUBE"]]
-            row = well[0]
-            col = str(int(well[1:]))
-            new_well = row + ":" + col
-            volume = line[headers["VOLAVG"]]
-            data[new_well] = volume
+            headers = {item: i for i, item in enumerate(line)}
+            break
+    else:
+        return data
+    tube_idx = headers["TUBE"]
+    vol_idx = headers["VOLAVG"]
+    # The data rows follow until the first blank row
+    for line in takewhile(any, pf):
+        well = line[tube_idx]
+        new_well = WELL_FMT.get(well) or (well[0] + ":" + str(int(well[1:])))
+        data[new_well] = float(line[vol_idx])
     return data
 
 
-def parse_vc100_results(process):
+def parse_vc100_results(process, delimiter=None):
     # strings returned to the EPP user
     log = []
+    # Fetch all output artifacts once, in a single batch request
+    outputs = process.all_outputs(resolve=True)
     # get file contents by parsing lims artifacts
-    (content, log) = get_vc100_file(process, log)
+    (content, log) = get_vc100_file(outputs, log)
     # parse the file and get the interesting data out
-    data = get_data(content)
-    used_wells = []
-    # Fill in LIMS field Volume (ul)
-    for target_file in process.result_files():
+    data = get_data(content, delimiter)
+    used_wells = set()
+    # Fill in LIMS field Volume (ul), collecting the result files to put them all at once
+    result_files = [out for out in outputs if out.output_type == "ResultFile"]
+    for target_file in result_files:
         well = target_file.samples[0].artifact.location[1]
-        used_wells.append(well)
+        used_wells.add(well)
         if well in data:
             # Set to 0 for negative values
-            if float(data[well]) > 0:
-                target_file.udf["Volume (ul)"] = float(data[well])
-            else:
-                target_file.udf["Volume (ul)"] = 0
+            target_file.udf["Volume (ul)"] = max(data[well], 0)
         else:
             log.append(f"Cannot find volume for well {well} in the VC100 CSV file.")
-        target_file.put()
-        set_field(target_file)
+    if result_files:
+        try:
+            process.lims.put_batch(result_files)
+        except HTTPError:
+            for target_file in result_files:
+                set_field(target_file)
 
     # Give warning messages if a well supposed to be empty give volume
-    wells_with_warning = []
-    for k, v in data.items():
-        if float(v) > VOL_WARNING_THRESHOLD and k not in used_wells:
-            wells_with_warning.append(k)
+    wells_with_warning = [
+        k for k, v in data.items() if k not in used_wells and v > VOL_WARNING_THRESHOLD
+    ]
     log.append(
         f"The following wells are supposed to be empty but give a volume higher than {VOL_WARNING_THRESHOLD}: {','.join(wells_with_warning)}"
     )
@@ -93,9 +118,9 @@ def parse_vc100_results(process):
         sys.stderr.write("; ".join(log))
 
 
-def main(lims, pid, epp_logger):
+def main(lims, pid, delimiter, epp_logger):
     process = Process(lims, id=pid)
-    parse_vc100_results(process)
+    parse_vc100_results(process, delimiter)
 
 
 if __name__ == "__main__":
@@ -110,6 +135,14 @@ if __name__ == "__main__":
             "File name for standard log file, " "for runtime information and problems."
         ),
     )
+    parser.add_argument(
+        "--delimiter",
+        dest="delimiter",
+        help=(
+            "Delimiter of the VC100 CSV file. If not given, "
+            "the CSV dialect is sniffed from the start of the file."
+        ),
+    )
 
     args = parser.parse_args()
 
@@ -117,4 +150,4 @@ if __name__ == "__main__":
     lims.check_version()
 
     with EppLogger(log_file=args.log, lims=lims, prepend=True) as epp_logger:
-        main(lims, args.pid, epp_logger)
+        main(lims, args.pid, args.delimiter, epp_logger)
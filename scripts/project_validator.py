@@ -1,8 +1,8 @@
 #!/usr/bin/env python
 
-import re
 import sys
 from argparse import ArgumentParser
+from contextlib import closing
 
 import psycopg2
 import yaml
@@ -17,39 +17,40 @@ DESC = """EPP used to validate a project
 Author: Chuan Wang, Science for Life Laboratory, Stockholm, Sweden
 """
 
-# Pre-compile regexes in global scope:
-NGISAMPLE_PAT = re.compile("P[0-9]+_[0-9]+")
-
 
 # Verify sample IDs
 def verify_sample_ids(project_id):
     message = []
-    # Query sample names with given project luid
+    # Query the names of samples with given project luid that either have a bad
+    # format or do not match the project ID, flagging which of the two applies
     query = (
-        "select sample.name from sample "
+        "select sample.name, sample.name ~ 'P[0-9]+_[0-9]+' from sample "
         "inner join project on sample.projectid=project.projectid "
-        "where project.luid = %s;"
+        "where project.luid = %s "
+        "and (sample.name !~ 'P[0-9]+_[0-9]+' "
+        "or split_part(sample.name, '_', 1) <> %s);"
     )
-    with psycopg2.connect(
-        user=config["username"],
-        host=config["url"],
-        database=config["db"],
-        password=config["password"],
+    # The connection's own context manager only ends the transaction, so close it explicitly
+    with closing(
+        psycopg2.connect(
+            user=config["username"],
+            host=config["url"],
+            database=config["db"],
+            password=config["password"],
+        )
     ) as connection:
-        with connection.cursor() as cursor:
-            cursor.execute(query, (project_id,))
+        with connection, connection.cursor() as cursor:
+            cursor.execute(query, (project_id, project_id))
             query_output = cursor.fetchall()
 
-    # Validate sample name format
-    for out in query_output:
-        sample_id = out[0]
-        if not NGISAMPLE_PAT.findall(sample_id):
+    # Report offending sample names
+    for sample_id, valid_format in query_output:
+        if not valid_format:
             message.append(f"SAMPLE NAME WARNING: Bad sample ID format {sample_id}")
         else:
-            if sample_id.split("_")[0] != project_id:
-                message.append(
-                    f"SAMPLE NAME WARNING: Sample ID {sample_id} does not match project ID {project_id}"
-                )
+            message.append(
+                f"SAMPLE NAME WARNING: Sample ID {sample_id} does not match project ID {project_id}"
+            )
 
     return message
 
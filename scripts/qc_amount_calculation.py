@@ -9,18 +9,31 @@ left unchanged, by the script.
 Johannes Alneberg, Science for Life Laboratory, Stockholm, Sweden
 """
 import logging
+import operator
 import sys
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
 
 from genologics.config import BASEURI, PASSWORD, USERNAME
 from genologics.entities import Process
 from genologics.lims import Lims
+from requests.exceptions import HTTPError
 
 from scilifelab_epps.epp import EppLogger
-from scilifelab_epps.utils import formula, udf_tools
+from scilifelab_epps.utils import formula
 
+# Arithmetic operators which can be applied to the UDF values
+OPERATORS = {
+    "*": operator.mul,
+    "/": operator.truediv,
+    "+": operator.add,
+    "-": operator.sub,
+}
 
-def apply_calculations(artifacts, udf1, op, udf2, unit_amount_map, process):
+
+def apply_calculations(
+    artifacts, udf1, op, udf2, unit_amount_map, unit_scale_map, process
+):
     """For each result file of the process: if its corresponding inart has the udf
     'Dilution Fold', the result_udf: 'Amount (xx)' is calculated as
 
@@ -28,101 +41,142 @@ def apply_calculations(artifacts, udf1, op, udf2, unit_amount_map, process):
 
     otherwise its calculated as
 
-    'Amount (xx)' =  'Concentration'*'Volume (ul)'"""
+    'Amount (xx)' =  'Concentration'*'Volume (ul)'
 
-    for artifact in artifacts:
-        result_udf = unit_amount_map[artifact.udf["Conc. Units"]]
+    The updated artifacts are put in a single batch request."""
 
-        try:
-            artifact.udf[result_udf]
-        except KeyError:
-            artifact.udf[result_udf] = 0
+    # Map sample names to input artifacts, fetching the inputs in a single batch request
+    sample_to_input = {}
+    for inart in process.all_inputs(resolve=True):
+        for sample in inart.samples:
+            sample_to_input.setdefault(sample.name, inart)
 
-        try:
-            inart = process.input_per_sample(artifact.samples[0].name)[0]
-            dil_fold = inart.udf["Dilution Fold"]
-        except:
-            dil_fold = None
+    # Loop invariants
+    operation = OPERATORS[op]
+    total_lysate = process.udf.get("Total Lysate Calculation", "")
+
+    # Previous supplemented amounts per artifact id, to restore if they can't be put
+    supplemented = {}
+    for artifact in artifacts:
+        # Read the UDFs once
+        udfs = artifact.udf
+        conc_units = udfs["Conc. Units"]
+        udf1_value = udfs[udf1]
+        result_udf = unit_amount_map[conc_units]
+        result_value = udfs.get(result_udf, 0)
+
+        inart = sample_to_input.get(artifact.samples[0].name)
+        dil_fold = inart.udf.get("Dilution Fold") if inart else None
 
         # Special calculation formula for total lysate
-        if process.udf.get("Total Lysate Calculation", ""):
+        if total_lysate:
             udf2_value = 234
         else:
-            udf2_value = artifact.udf[udf2]
+            udf2_value = udfs[udf2]
 
         logging.info(
-            f"Updating: Artifact id: {artifact.id}, "
-            f"result_udf: {artifact.udf.get(result_udf, 0)}, udf1: {artifact.udf[udf1]}, "
-            f"operator: {op}, udf2: {udf2_value}"
+            "Updating: Artifact id: %s, result_udf: %s, udf1: %s, operator: %s, udf2: %s",
+            artifact.id,
+            result_value,
+            udf1_value,
+            op,
+            udf2_value,
         )
-        prod = eval(f"{artifact.udf[udf1]}{op}{udf2_value}")
+        prod = operation(udf1_value, udf2_value)
         if dil_fold:
-            prod = eval(f"{prod}{op}{dil_fold}")
-        if artifact.udf["Conc. Units"] == "pM":
-            prod = eval(f"{prod}{op}{1 / 1000}")
-        artifact.udf[result_udf] = prod
+            prod = operation(prod, dil_fold)
+        # Scale to the unit of the result, e.g. pM --> nM
+        prod = operation(prod, unit_scale_map[conc_units])
+        udfs[result_udf] = prod
+
+        logging.info("Updated %s to %s.", result_udf, prod)
+        if previous_supplemented := calculate_fmol_AND_ng(
+            artifact, result_udf, prod, udfs.get("Size (bp)")
+        ):
+            supplemented[artifact.id] = previous_supplemented
+
+    try:
+        process.lims.put_batch(artifacts)
+    except HTTPError:
+        # Put the artifacts one by one, handling them concurrently
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            list(
+                executor.map(
+                    lambda artifact: put_artifact(
+                        artifact, supplemented.get(artifact.id)
+                    ),
+                    artifacts,
+                )
+            )
 
-        artifact.put()
 
-        logging.info(f"Updated {result_udf} to {artifact.udf[result_udf]}.")
-        calculate_fmol_AND_ng(artifact, result_udf)
+def put_artifact(artifact, previous_supplemented=None):
+    """Put an artifact. If it fails and a supplemented amount was set, restore the
+    amount to its previous value and try again."""
+    try:
+        artifact.put()
+    except HTTPError:
+        if previous_supplemented is None:
+            raise
+        supplemented_udf, previous_amount = previous_supplemented
+        if previous_amount is None:
+            del artifact.udf[supplemented_udf]
+        else:
+            artifact.udf[supplemented_udf] = previous_amount
+        artifact.put()
 
 
-def calculate_fmol_AND_ng(art, result_udf):
-    """Use ng <--> fmol conversion to populate both 'Amount (ng)' and 'Amount (fmol)' if possible."""
+def calculate_fmol_AND_ng(art, result_udf, result_amount, size):
+    """Use ng <--> fmol conversion to populate both 'Amount (ng)' and 'Amount (fmol)' if possible.
 
-    size_udf = "Size (bp)"
+    The result amount and size (bp) are given by the caller, which has already read them.
+    The supplemented UDF is set but left for the caller to put. Returns its name and
+    previous value, to be able to restore it."""
 
-    if udf_tools.is_filled(art, result_udf) and udf_tools.is_filled(art, size_udf):
-        result_amount = art.udf[result_udf]
-        size = art.udf[size_udf]
+    if size is None:
+        return None
 
-        if result_udf == "Amount (ng)":
-            supplemented_udf = "Amount (fmol)"
-            supplemented_amount = round(formula.ng_to_fmol(result_amount, size), 2)
-        elif result_udf == "Amount (fmol)":
-            supplemented_udf = "Amount (ng)"
-            supplemented_amount = round(formula.fmol_to_ng(result_amount, size), 2)
+    if result_udf == "Amount (ng)":
+        supplemented_udf = "Amount (fmol)"
+        supplemented_amount = round(formula.ng_to_fmol(result_amount, size), 2)
+    elif result_udf == "Amount (fmol)":
+        supplemented_udf = "Amount (ng)"
+        supplemented_amount = round(formula.fmol_to_ng(result_amount, size), 2)
 
-        if udf_tools.put(art, supplemented_udf, supplemented_amount, on_fail=None):
-            logging.info(f"Updated {supplemented_udf} to {supplemented_amount}.")
+    previous_amount = art.udf.get(supplemented_udf)
+    art.udf[supplemented_udf] = supplemented_amount
+    logging.info("Updated %s to %s.", supplemented_udf, supplemented_amount)
+    return supplemented_udf, previous_amount
 
 
-def check_udf_is_defined(artifacts, udf):
-    """Filter and Warn if udf is not defined for any of artifacts."""
+def check_udfs(artifacts, required_udfs, check_udf, values):
+    """Filter artifacts on undefined required udfs, or if the check udf is undefined or
+    has a wrong value, in a single pass. Warn about the first problem of each artifact."""
     filtered_artifacts = []
     incorrect_artifacts = []
     for artifact in artifacts:
-        if udf in artifact.udf:
-            filtered_artifacts.append(artifact)
-        else:
+        udfs = artifact.udf
+        missing_udf = next((udf for udf in required_udfs if udf not in udfs), None)
+        if missing_udf is not None:
+            incorrect_artifacts.append(artifact)
             logging.warning(
-                f"Found artifact for sample {artifact.samples[0].name} with {udf} "
+                f"Found artifact for sample {artifact.samples[0].name} with {missing_udf} "
                 "undefined/blank, skipping"
             )
-            incorrect_artifacts.append(artifact)
-    return filtered_artifacts, incorrect_artifacts
-
-
-def check_udf_has_value(artifacts, udf, value):
-    """Filter artifacts on undefined udf or if udf has wrong value."""
-    filtered_artifacts = []
-    incorrect_artifacts = []
-    for artifact in artifacts:
-        if udf in artifact.udf and (artifact.udf[udf] in value.keys()):
-            filtered_artifacts.append(artifact)
-        elif udf in artifact.udf:
+        elif check_udf not in udfs:
             incorrect_artifacts.append(artifact)
             logging.warning(
                 f"Filtered out artifact for sample: {artifact.samples[0].name}"
-                f", due to wrong {udf}"
+                f", due to undefined/blank {check_udf}"
             )
-        else:
+        elif udfs[check_udf] not in values:
             incorrect_artifacts.append(artifact)
             logging.warning(
                 f"Filtered out artifact for sample: {artifact.samples[0].name}"
-                f", due to undefined/blank {udf}"
+                f", due to wrong {check_udf}"
             )
+        else:
+            filtered_artifacts.append(artifact)
 
     return filtered_artifacts, incorrect_artifacts
 
@@ -139,30 +193,44 @@ def main(lims, args, epp_logger):
         "nM": "Amount (fmol)",
         "pM": "Amount (fmol)",
     }
+    unit_scale_map = {
+        "ng/ul": 1.0,
+        "ng/uL": 1.0,
+        "nM": 1.0,
+        "pM": 0.001,
+    }
 
+    # Fetch the artifacts and their samples in batch requests, rather than lazily
     if args.aggregate:
-        artifacts = p.all_inputs(unique=True)
+        artifacts = p.all_inputs(unique=True, resolve=True)
     else:
-        all_artifacts = p.all_outputs(unique=True)
-        artifacts = [a for a in all_artifacts if a.output_type == "ResultFile"]
-
-    correct_artifacts, wrong_factor1 = check_udf_is_defined(artifacts, udf_factor1)
-    correct_artifacts, wrong_factor2 = check_udf_is_defined(
-        correct_artifacts, udf_factor2
-    )
-
-    correct_artifacts, wrong_value = check_udf_has_value(
-        correct_artifacts, udf_check, unit_amount_map
+        # The output types are given by the input-output maps, no need to fetch others
+        result_files = {
+            output["uri"].id: output["uri"]
+            for _, output in p.input_output_maps
+            if output and output["output-type"] == "ResultFile"
+        }
+        artifacts = lims.get_batch(list(result_files.values()))
+    lims.get_batch(list({a.samples[0].id: a.samples[0] for a in artifacts}.values()))
+
+    correct_artifacts, incorrect_artifacts = check_udfs(
+        artifacts, (udf_factor1, udf_factor2), udf_check, unit_amount_map
     )
 
     if correct_artifacts:
         apply_calculations(
-            correct_artifacts, udf_factor1, "*", udf_factor2, unit_amount_map, p
+            correct_artifacts,
+            udf_factor1,
+            "*",
+            udf_factor2,
+            unit_amount_map,
+            unit_scale_map,
+            p,
         )
 
     d = {
         "ca": len(correct_artifacts),
-        "ia": len(wrong_factor1) + len(wrong_factor2) + len(wrong_value),
+        "ia": len(incorrect_artifacts),
     }
 
     abstract = (
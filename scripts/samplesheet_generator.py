@@ -1,14 +1,15 @@
 #!/usr/bin/env python
 
+import csv
+import io
 import json
 import os
 import re
 import sys
 from argparse import ArgumentParser
 from datetime import datetime
-from io import StringIO
 
-import pandas as pd
+import numpy as np
 from genologics.config import BASEURI, PASSWORD, USERNAME
 from genologics.entities import Process
 from genologics.lims import Lims
@@ -32,7 +33,13 @@ SMARTSEQ_PAT = re.compile("SMARTSEQ[1-9]?-[1-9][0-9]?[A-P]")
 NGISAMPLE_PAT = re.compile("P[0-9]+_[0-9]+")
 SEQSETUP_PAT = re.compile("[0-9]+-[0-9A-z]+-[0-9A-z]+-[0-9]+")
 
-compl = {"A": "T", "C": "G", "G": "C", "T": "A"}
+# Translation table to complement DNA sequences
+COMPL_TRANS = str.maketrans("ACGT", "TGCA")
+
+# Translation tables to sanitize names for the samplesheet
+CONTROL_NAME_TRANS = str.maketrans({"(": None, ")": None, ".": None, " ": "_"})
+PROJECT_NAME_TRANS = str.maketrans({".": "__", ",": None})
+OPERATOR_NAME_TRANS = str.maketrans({" ": "_", ",": None})
 
 
 def check_index_distance(data, log):
@@ -41,23 +48,35 @@ def check_index_distance(data, log):
         indexes = [
             x.get("idx1", "") + x.get("idx2", "") for x in data if x["lane"] == l
         ]
-        if not indexes or len(indexes) == 1:
-            return None
-        for i, b in enumerate(indexes[:-1]):
-            start = i + 1
-            for b2 in indexes[start:]:
-                d = my_distance(b, b2)
-                if d < 2 and not is_special_idx(b) and not is_special_idx(b2):
-                    log.append(
-                        f"Found indexes {b} and {b2} in lane {l}, indexes are too close"
-                    )
+        if len(indexes) < 2:
+            continue
+        # Pairwise Hamming distances, over the length of the shorter index of each pair
+        distances = index_distances(indexes)
+        # Special indexes are exempt, check each index only once
+        special = [is_special_idx(b) for b in indexes]
+        # Only report the first index that is too close to each index
+        reported = set()
+        for i, j in np.argwhere(np.triu(distances < 2, k=1)):
+            if i in reported:
+                continue
+            b, b2 = indexes[i], indexes[j]
+            if not special[i] and not special[j]:
+                log.append(
+                    f"Found indexes {b} and {b2} in lane {l}, indexes are too close"
+                )
+                reported.add(i)
+
+
+def revcomp(seq):
+    """Reverse complement a DNA sequence, leaving any non-ACGT characters as is."""
+    return seq.translate(COMPL_TRANS)[::-1]
 
 
 def is_special_idx(idx_name):
     if (
-        TENX_DUAL_PAT.findall(idx_name)
-        or TENX_SINGLE_PAT.findall(idx_name)
-        or SMARTSEQ_PAT.findall(idx_name)
+        TENX_DUAL_PAT.search(idx_name)
+        or TENX_SINGLE_PAT.search(idx_name)
+        or SMARTSEQ_PAT.search(idx_name)
         or idx_name == "NoIndex"
     ):
         return True
@@ -65,15 +84,17 @@ def is_special_idx(idx_name):
         return False
 
 
-def my_distance(idx1, idx2):
-    short = min((idx1, idx2), key=len)
-    lon = idx1 if short == idx2 else idx2
-
-    diffs = 0
-    for i, c in enumerate(short):
-        if c != lon[i]:
-            diffs += 1
-    return diffs
+def index_distances(indexes):
+    """Matrix of the pairwise Hamming distances between indexes, counting only the
+    positions covered by the shorter index of each pair."""
+    encoded = [idx.encode() for idx in indexes]
+    lengths = np.array([len(idx) for idx in encoded])
+    # Pack the indexes into a zero-padded byte matrix
+    arr = np.zeros((len(encoded), lengths.max(initial=0)), dtype=np.uint8)
+    for row, idx in enumerate(encoded):
+        arr[row, : len(idx)] = np.frombuffer(idx, dtype=np.uint8)
+    covered = np.arange(arr.shape[1]) < np.minimum.outer(lengths, lengths)[..., None]
+    return np.count_nonzero((arr[:, None, :] != arr[None, :, :]) & covered, axis=-1)
 
 
 def gen_Novaseq_lane_data(pro):
@@ -92,71 +113,59 @@ def gen_Novaseq_lane_data(pro):
         "Operator",
         "Sample_Project",
     ]
+    # Values shared by all rows
+    operator = pro.technician.name.translate(OPERATOR_NAME_TRANS)
+    reagent_version = pro.udf.get("Reagent Version")
     for out in pro.all_outputs():
         if out.type == "Analyte":
+            flowcell = out.location[0].name.replace(",", "")
+            well = out.location[1].replace(",", "")
+            lane = well.split(":")[0]
             for sample in out.samples:
                 sample_idxs = set()
                 find_barcode(sample_idxs, sample, pro)
                 for idxs in sample_idxs:
                     sp_obj = {}
-                    sp_obj["lane"] = out.location[1].split(":")[0].replace(",", "")
-                    if NGISAMPLE_PAT.findall(sample.name):
+                    sp_obj["lane"] = lane
+                    if NGISAMPLE_PAT.search(sample.name):
                         sp_obj["sid"] = f"Sample_{sample.name}".replace(",", "")
                         sp_obj["sn"] = sample.name.replace(",", "")
-                        sp_obj["pj"] = sample.project.name.replace(".", "__").replace(
-                            ",", ""
-                        )
+                        sp_obj["pj"] = sample.project.name.translate(PROJECT_NAME_TRANS)
                         sp_obj["ref"] = sample.project.udf.get(
                             "Reference genome", ""
                         ).replace(",", "")
                         seq_setup = sample.project.udf.get("Sequencing setup", "")
-                        if SEQSETUP_PAT.findall(seq_setup):
-                            sp_obj["rc"] = "{}-{}".format(
-                                seq_setup.split("-")[0], seq_setup.split("-")[3]
-                            )
+                        if SEQSETUP_PAT.search(seq_setup):
+                            setup_parts = seq_setup.split("-")
+                            sp_obj["rc"] = f"{setup_parts[0]}-{setup_parts[3]}"
                         else:
                             sp_obj["rc"] = "0-0"
                     else:
-                        sp_obj["sid"] = (
-                            f"Sample_{sample.name}".replace("(", "")
-                            .replace(")", "")
-                            .replace(".", "")
-                            .replace(" ", "_")
-                        )
-                        sp_obj["sn"] = (
-                            sample.name.replace("(", "")
-                            .replace(")", "")
-                            .replace(".", "")
-                            .replace(" ", "_")
+                        sp_obj["sid"] = f"Sample_{sample.name}".translate(
+                            CONTROL_NAME_TRANS
                         )
+                        sp_obj["sn"] = sample.name.translate(CONTROL_NAME_TRANS)
                         sp_obj["pj"] = "Control"
                         sp_obj["ref"] = "Control"
                         sp_obj["rc"] = "0-0"
                     sp_obj["ct"] = "N"
-                    sp_obj["op"] = pro.technician.name.replace(" ", "_").replace(
-                        ",", ""
-                    )
-                    sp_obj["fc"] = out.location[0].name.replace(",", "")
-                    sp_obj["sw"] = out.location[1].replace(",", "")
+                    sp_obj["op"] = operator
+                    sp_obj["fc"] = flowcell
+                    sp_obj["sw"] = well
                     sp_obj["idx1"] = idxs[0].replace(",", "").upper()
                     if idxs[1]:
-                        if pro.udf["Reagent Version"] == "v1.5":
+                        if reagent_version == "v1.5":
                             sp_obj["idx2"] = idxs[1].replace(",", "").upper()
-                        elif pro.udf["Reagent Version"] == "v1.0":
-                            sp_obj["idx2"] = "".join(
-                                reversed(
-                                    [
-                                        compl.get(b, b)
-                                        for b in idxs[1].replace(",", "").upper()
-                                    ]
-                                )
-                            )
+                        elif reagent_version == "v1.0":
+                            sp_obj["idx2"] = revcomp(idxs[1].replace(",", "").upper())
                     else:
                         sp_obj["idx2"] = ""
                     data.append(sp_obj)
-    header = "{}\n".format(",".join(header_ar))
-    str_data = ""
-    for line in sorted(data, key=lambda x: x["lane"]):
+    # Write the rows through a single csv writer
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    writer.writerow(header_ar)
+    for line in sorted(data, key=lambda x: (int(x["lane"]), x["sn"])):
         l_data = [
             line["fc"],
             line["lane"],
@@ -171,12 +180,9 @@ def gen_Novaseq_lane_data(pro):
             line["op"],
             line["pj"],
         ]
-        str_data = str_data + ",".join(l_data) + "\n"
+        writer.writerow(l_data)
 
-    content = f"{header}{str_data}"
-    df = pd.read_csv(StringIO(content))
-    df = df.sort_values(["Lane", "Sample_ID"])
-    content = df.to_csv(index=False)
+    content = buf.getvalue()
 
     return (content, data)
 
@@ -197,61 +203,55 @@ def gen_NovaSeqXPlus_lane_data(pro):
         "Operator",
         "Sample_Project",
     ]
+    # Values shared by all rows
+    operator = pro.technician.name.translate(OPERATOR_NAME_TRANS)
     for out in pro.all_outputs():
         if out.type == "Analyte":
+            flowcell = out.location[0].name.replace(",", "")
+            well = out.location[1].replace(",", "")
+            lane = well.split(":")[0]
             for sample in out.samples:
                 sample_idxs = set()
                 find_barcode(sample_idxs, sample, pro)
                 for idxs in sample_idxs:
                     sp_obj = {}
-                    sp_obj["lane"] = out.location[1].split(":")[0].replace(",", "")
-                    if NGISAMPLE_PAT.findall(sample.name):
+                    sp_obj["lane"] = lane
+                    if NGISAMPLE_PAT.search(sample.name):
                         sp_obj["sid"] = f"Sample_{sample.name}".replace(",", "")
                         sp_obj["sn"] = sample.name.replace(",", "")
-                        sp_obj["pj"] = sample.project.name.replace(".", "__").replace(
-                            ",", ""
-                        )
+                        sp_obj["pj"] = sample.project.name.translate(PROJECT_NAME_TRANS)
                         sp_obj["ref"] = sample.project.udf.get(
                             "Reference genome", ""
                         ).replace(",", "")
                         seq_setup = sample.project.udf.get("Sequencing setup", "")
-                        if SEQSETUP_PAT.findall(seq_setup):
-                            sp_obj["rc"] = "{}-{}".format(
-                                seq_setup.split("-")[0], seq_setup.split("-")[3]
-                            )
+                        if SEQSETUP_PAT.search(seq_setup):
+                            setup_parts = seq_setup.split("-")
+                            sp_obj["rc"] = f"{setup_parts[0]}-{setup_parts[3]}"
                         else:
                             sp_obj["rc"] = "0-0"
                     else:
-                        sp_obj["sid"] = (
-                            f"Sample_{sample.name}".replace("(", "")
-                            .replace(")", "")
-                            .replace(".", "")
-                            .replace(" ", "_")
-                        )
-                        sp_obj["sn"] = (
-                            sample.name.replace("(", "")
-                            .replace(")", "")
-                            .replace(".", "")
-                            .replace(" ", "_")
+                        sp_obj["sid"] = f"Sample_{sample.name}".translate(
+                            CONTROL_NAME_TRANS
                         )
+                        sp_obj["sn"] = sample.name.translate(CONTROL_NAME_TRANS)
                         sp_obj["pj"] = "Control"
                         sp_obj["ref"] = "Control"
                         sp_obj["rc"] = "0-0"
                     sp_obj["ct"] = "N"
-                    sp_obj["op"] = pro.technician.name.replace(" ", "_").replace(
-                        ",", ""
-                    )
-                    sp_obj["fc"] = out.location[0].name.replace(",", "")
-                    sp_obj["sw"] = out.location[1].replace(",", "")
+                    sp_obj["op"] = operator
+                    sp_obj["fc"] = flowcell
+                    sp_obj["sw"] = well
                     sp_obj["idx1"] = idxs[0].replace(",", "").upper()
                     if idxs[1]:
                         sp_obj["idx2"] = idxs[1].replace(",", "").upper()
                     else:
                         sp_obj["idx2"] = ""
                     data.append(sp_obj)
-    header = "{}\n".format(",".join(header_ar))
-    str_data = ""
-    for line in sorted(data, key=lambda x: x["lane"]):
+    # Write the rows through a single csv writer
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    writer.writerow(header_ar)
+    for line in sorted(data, key=lambda x: (int(x["lane"]), x["sn"])):
         l_data = [
             line["fc"],
             line["lane"],
@@ -266,12 +266,9 @@ def gen_NovaSeqXPlus_lane_data(pro):
             line["op"],
             line["pj"],
         ]
-        str_data = str_data + ",".join(l_data) + "\n"
+        writer.writerow(l_data)
 
-    content = f"{header}{str_data}"
-    df = pd.read_csv(StringIO(content))
-    df = df.sort_values(["Lane", "Sample_ID"])
-    content = df.to_csv(index=False)
+    content = buf.getvalue()
 
     return (content, data)
 
@@ -357,20 +354,22 @@ def gen_Miseq_data(pro):
         "op",
         "pj",
     ]
+    # Values shared by all rows
+    operator = pro.technician.name.translate(OPERATOR_NAME_TRANS)
     for out in pro.all_outputs():
         if out.type == "Analyte":
+            flowcell = out.location[0].name.replace(",", "")
+            well = out.location[1].replace(",", "")
             for sample in out.samples:
                 sample_idxs = set()
                 find_barcode(sample_idxs, sample, pro)
                 for idxs in sample_idxs:
                     sp_obj = {}
                     sp_obj["lane"] = "1"
-                    if NGISAMPLE_PAT.findall(sample.name):
+                    if NGISAMPLE_PAT.search(sample.name):
                         sp_obj["sid"] = f"Sample_{sample.name}".replace(",", "")
                         sp_obj["sn"] = sample.name.replace(",", "")
-                        sp_obj["pj"] = sample.project.name.replace(".", "__").replace(
-                            ",", ""
-                        )
+                        sp_obj["pj"] = sample.project.name.translate(PROJECT_NAME_TRANS)
                         sp_obj["ref"] = sample.project.udf.get(
                             "Reference genome", ""
                         ).replace(",", "")
@@ -381,41 +380,28 @@ def gen_Miseq_data(pro):
                             == "Finished library (by user)"
                             else "inhouse"
                         )
-                        if SEQSETUP_PAT.findall(seq_setup):
-                            sp_obj["rc"] = "{}-{}".format(
-                                seq_setup.split("-")[0], seq_setup.split("-")[3]
-                            )
+                        if SEQSETUP_PAT.search(seq_setup):
+                            setup_parts = seq_setup.split("-")
+                            sp_obj["rc"] = f"{setup_parts[0]}-{setup_parts[3]}"
                         else:
                             sp_obj["rc"] = "0-0"
                     else:
-                        sp_obj["sid"] = (
-                            f"Sample_{sample.name}".replace("(", "")
-                            .replace(")", "")
-                            .replace(".", "")
-                            .replace(" ", "_")
-                        )
-                        sp_obj["sn"] = (
-                            sample.name.replace("(", "")
-                            .replace(")", "")
-                            .replace(".", "")
-                            .replace(" ", "_")
+                        sp_obj["sid"] = f"Sample_{sample.name}".translate(
+                            CONTROL_NAME_TRANS
                         )
+                        sp_obj["sn"] = sample.name.translate(CONTROL_NAME_TRANS)
                         sp_obj["pj"] = "Control"
                         sp_obj["ref"] = "Control"
                         sp_obj["rc"] = "0-0"
                         pj_type = "Control"
                     sp_obj["ct"] = "N"
-                    sp_obj["op"] = pro.technician.name.replace(" ", "_").replace(
-                        ",", ""
-                    )
-                    sp_obj["fc"] = out.location[0].name.replace(",", "")
-                    sp_obj["sw"] = out.location[1].replace(",", "")
+                    sp_obj["op"] = operator
+                    sp_obj["fc"] = flowcell
+                    sp_obj["sw"] = well
 
                     # Expand 10X single indexes
-                    if TENX_SINGLE_PAT.findall(idxs[0]):
-                        for tenXidx in Chromium_10X_indexes[
-                            TENX_SINGLE_PAT.findall(idxs[0])[0]
-                        ]:
+                    if tenx_match := TENX_SINGLE_PAT.search(idxs[0]):
+                        for tenXidx in Chromium_10X_indexes[tenx_match.group()]:
                             sp_obj_sub = {}
                             sp_obj_sub["lane"] = sp_obj["lane"]
                             sp_obj_sub["sid"] = sp_obj["sid"]
@@ -431,25 +417,13 @@ def gen_Miseq_data(pro):
                             sp_obj_sub["idx2"] = ""
                             data.append(sp_obj_sub)
                     # Case of 10X dual indexes
-                    elif TENX_DUAL_PAT.findall(idxs[0]):
-                        sp_obj["idx1"] = Chromium_10X_indexes[
-                            TENX_DUAL_PAT.findall(idxs[0])[0]
-                        ][0].replace(",", "")
-                        sp_obj["idx2"] = "".join(
-                            reversed(
-                                [
-                                    compl.get(b, b)
-                                    for b in Chromium_10X_indexes[
-                                        TENX_DUAL_PAT.findall(idxs[0])[0]
-                                    ][1]
-                                    .replace(",", "")
-                                    .upper()
-                                ]
-                            )
-                        )
+                    elif tenx_match := TENX_DUAL_PAT.search(idxs[0]):
+                        tenx_idxs = Chromium_10X_indexes[tenx_match.group()]
+                        sp_obj["idx1"] = tenx_idxs[0].replace(",", "")
+                        sp_obj["idx2"] = revcomp(tenx_idxs[1].replace(",", "").upper())
                         data.append(sp_obj)
                     # Case of SS3 indexes
-                    elif SMARTSEQ_PAT.findall(idxs[0]):
+                    elif SMARTSEQ_PAT.search(idxs[0]):
                         for i7_idx in SMARTSEQ3_indexes[idxs[0]][0]:
                             for i5_idx in SMARTSEQ3_indexes[idxs[0]][1]:
                                 sp_obj_sub = {}
@@ -464,13 +438,8 @@ def gen_Miseq_data(pro):
                                 sp_obj_sub["fc"] = sp_obj["fc"]
                                 sp_obj_sub["sw"] = sp_obj["sw"]
                                 sp_obj_sub["idx1"] = i7_idx
-                                sp_obj_sub["idx2"] = "".join(
-                                    reversed(
-                                        [
-                                            compl.get(b, b)
-                                            for b in i5_idx.replace(",", "").upper()
-                                        ]
-                                    )
+                                sp_obj_sub["idx2"] = revcomp(
+                                    i5_idx.replace(",", "").upper()
                                 )
                                 data.append(sp_obj_sub)
                     # NoIndex cases
@@ -488,13 +457,8 @@ def gen_Miseq_data(pro):
                             if pj_type == "by user":
                                 sp_obj["idx2"] = idxs[1].replace(",", "").upper()
                             else:
-                                sp_obj["idx2"] = "".join(
-                                    reversed(
-                                        [
-                                            compl.get(b, b)
-                                            for b in idxs[1].replace(",", "").upper()
-                                        ]
-                                    )
+                                sp_obj["idx2"] = revcomp(
+                                    idxs[1].replace(",", "").upper()
                                 )
                         else:
                             sp_obj["idx2"] = ""
@@ -509,18 +473,14 @@ def gen_Miseq_data(pro):
         key_order.remove("idx2")
         chem = "Default"
 
-    header = "{}\n".format(",".join(header_ar))
-    str_data = ""
-    for line in sorted(data, key=lambda x: x["lane"]):
-        l_data = []
-        for key in key_order:
-            l_data.append(line[key])
-        str_data = str_data + ",".join(l_data) + "\n"
-
-    content = f"{header}{str_data}"
-    df = pd.read_csv(StringIO(content))
-    df = df.sort_values(["Lane", "Sample_ID"])
-    content = df.to_csv(index=False)
+    # Write the rows through a single csv writer
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    writer.writerow(header_ar)
+    for line in sorted(data, key=lambda x: (int(x["lane"]), x["sn"])):
+        writer.writerow([line[key] for key in key_order])
+
+    content = buf.getvalue()
     content = f"[Data]\n{content}\n"
 
     return (content, data, chem)
@@ -542,61 +502,55 @@ def gen_Nextseq_lane_data(pro):
         "Operator",
         "Sample_Project",
     ]
+    # Values shared by all rows
+    operator = pro.technician.name.translate(OPERATOR_NAME_TRANS)
     for out in pro.all_outputs():
         if out.type == "Analyte":
+            flowcell = out.location[0].name.replace(",", "")
+            well = out.location[1].replace(",", "")
+            lane = well.split(":")[0]
             for sample in out.samples:
                 sample_idxs = set()
                 find_barcode(sample_idxs, sample, pro)
                 for idxs in sample_idxs:
                     sp_obj = {}
-                    sp_obj["lane"] = out.location[1].split(":")[0].replace(",", "")
-                    if NGISAMPLE_PAT.findall(sample.name):
+                    sp_obj["lane"] = lane
+                    if NGISAMPLE_PAT.search(sample.name):
                         sp_obj["sid"] = f"Sample_{sample.name}".replace(",", "")
                         sp_obj["sn"] = sample.name.replace(",", "")
-                        sp_obj["pj"] = sample.project.name.replace(".", "__").replace(
-                            ",", ""
-                        )
+                        sp_obj["pj"] = sample.project.name.translate(PROJECT_NAME_TRANS)
                         sp_obj["ref"] = sample.project.udf.get(
                             "Reference genome", ""
                         ).replace(",", "")
                         seq_setup = sample.project.udf.get("Sequencing setup", "")
-                        if SEQSETUP_PAT.findall(seq_setup):
-                            sp_obj["rc"] = "{}-{}".format(
-                                seq_setup.split("-")[0], seq_setup.split("-")[3]
-                            )
+                        if SEQSETUP_PAT.search(seq_setup):
+                            setup_parts = seq_setup.split("-")
+                            sp_obj["rc"] = f"{setup_parts[0]}-{setup_parts[3]}"
                         else:
                             sp_obj["rc"] = "0-0"
                     else:
-                        sp_obj["sid"] = (
-                            f"Sample_{sample.name}".replace("(", "")
-                            .replace(")", "")
-                            .replace(".", "")
-                            .replace(" ", "_")
-                        )
-                        sp_obj["sn"] = (
-                            sample.name.replace("(", "")
-                            .replace(")", "")
-                            .replace(".", "")
-                            .replace(" ", "_")
+                        sp_obj["sid"] = f"Sample_{sample.name}".translate(
+                            CONTROL_NAME_TRANS
                         )
+                        sp_obj["sn"] = sample.name.translate(CONTROL_NAME_TRANS)
                         sp_obj["pj"] = "Control"
                         sp_obj["ref"] = "Control"
                         sp_obj["rc"] = "0-0"
                     sp_obj["ct"] = "N"
-                    sp_obj["op"] = pro.technician.name.replace(" ", "_").replace(
-                        ",", ""
-                    )
-                    sp_obj["fc"] = out.location[0].name.replace(",", "")
-                    sp_obj["sw"] = out.location[1].replace(",", "")
+                    sp_obj["op"] = operator
+                    sp_obj["fc"] = flowcell
+                    sp_obj["sw"] = well
                     sp_obj["idx1"] = idxs[0].replace(",", "")
                     if idxs[1]:
                         sp_obj["idx2"] = idxs[1].replace(",", "").upper()
                     else:
                         sp_obj["idx2"] = ""
                     data.append(sp_obj)
-    header = "{}\n".format(",".join(header_ar))
-    str_data = ""
-    for line in sorted(data, key=lambda x: x["lane"]):
+    # Write the rows through a single csv writer
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    writer.writerow(header_ar)
+    for line in sorted(data, key=lambda x: (int(x["lane"]), x["sn"])):
         l_data = [
             line["fc"],
             line["lane"],
@@ -611,48 +565,56 @@ def gen_Nextseq_lane_data(pro):
             line["op"],
             line["pj"],
         ]
-        str_data = str_data + ",".join(l_data) + "\n"
+        writer.writerow(l_data)
 
-    content = f"{header}{str_data}"
-    df = pd.read_csv(StringIO(content))
-    df = df.sort_values(["Lane", "Sample_ID"])
-    content = df.to_csv(index=False)
+    content = buf.getvalue()
 
     return (content, data)
 
 
+# Indexes found per (process id, sample id) and inputs per process id, since the same
+# processes are walked for every sample and lane
+BARCODE_CACHE = {}
+PROCESS_INPUTS_CACHE = {}
+
+
 def find_barcode(sample_idxs, sample, process):
     # print "trying to find {} barcode in {}".format(sample.name, process.name)
-    for art in process.all_inputs():
-        if sample in art.samples:
-            if len(art.samples) == 1 and art.reagent_labels:
-                reagent_label_name = art.reagent_labels[0].upper().replace(" ", "")
-                idxs = (
-                    TENX_SINGLE_PAT.findall(reagent_label_name)
-                    or TENX_DUAL_PAT.findall(reagent_label_name)
-                    or SMARTSEQ_PAT.findall(reagent_label_name)
-                )
-                if idxs:
-                    # Put in tuple with empty string as second index to
-                    # match expected type:
-                    sample_idxs.add((idxs[0], ""))
-                else:
-                    try:
-                        idxs = IDX_PAT.findall(reagent_label_name)[0]
-                        sample_idxs.add(idxs)
-                    except IndexError:
+    key = (process.id, sample.id)
+    if key not in BARCODE_CACHE:
+        if process.id not in PROCESS_INPUTS_CACHE:
+            PROCESS_INPUTS_CACHE[process.id] = process.all_inputs()
+        process_inputs = PROCESS_INPUTS_CACHE[process.id]
+        found_idxs = set()
+        for art in process_inputs:
+            if sample in art.samples:
+                if len(art.samples) == 1 and art.reagent_labels:
+                    reagent_label_name = art.reagent_labels[0].upper().replace(" ", "")
+                    idx_match = (
+                        TENX_SINGLE_PAT.search(reagent_label_name)
+                        or TENX_DUAL_PAT.search(reagent_label_name)
+                        or SMARTSEQ_PAT.search(reagent_label_name)
+                    )
+                    if idx_match:
+                        # Put in tuple with empty string as second index to
+                        # match expected type:
+                        found_idxs.add((idx_match.group(), ""))
+                    elif idx_match := IDX_PAT.search(reagent_label_name):
+                        found_idxs.add(idx_match.groups())
+                    else:
                         try:
                             # we only have the reagent label name.
                             rt = lims.get_reagent_types(name=reagent_label_name)[0]
-                            idxs = IDX_PAT.findall(rt.sequence)[0]
-                            sample_idxs.add(idxs)
+                            found_idxs.add(IDX_PAT.search(rt.sequence).groups())
                         except:
-                            sample_idxs.add(("NoIndex", ""))
-            else:
-                if art == sample.artifact or not art.parent_process:
-                    pass
+                            found_idxs.add(("NoIndex", ""))
                 else:
-                    find_barcode(sample_idxs, sample, art.parent_process)
+                    if art == sample.artifact or not art.parent_process:
+                        pass
+                    else:
+                        find_barcode(found_idxs, sample, art.parent_process)
+        BARCODE_CACHE[key] = frozenset(found_idxs)
+    sample_idxs.update(BARCODE_CACHE[key])
 
 
 def test():